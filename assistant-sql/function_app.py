@@ -1,25 +1,164 @@
 import logging
 import azure.functions as func
 from openai import AzureOpenAI
+import httpx
 import os
 import json
 import pyodbc
 import time
 import re
+import hashlib
+import math
+import functools
+import threading
+import tempfile
+import mmap
+import struct
+import uuid
+from logging.handlers import RotatingFileHandler
+from xml.etree import ElementTree
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from decimal import Decimal, InvalidOperation
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
 app = func.FunctionApp()
 
 # Cache global pour le schéma (durée : 5 minutes)
 schema_cache = {
-    "data": None,
+    "data": None,       # forme lisible (TestConnection)
+    "compact": None,    # forme compacte (prompts)
+    "metadata": None,
     "timestamp": 0,
+    "refresh_seconds": 0,  # durée de la dernière lecture complète (budget du préchauffage)
     "cache_duration": 300  # 5 minutes en secondes
 }
 
+# Sérialisation compacte du schéma pour les prompts
+SCHEMA_PROMPT_TOKEN_BUDGET = int(os.getenv("SCHEMA_PROMPT_TOKEN_BUDGET", "2000"))
+SCHEMA_SAMPLE_ROWS = 20
+SCHEMA_SAMPLE_MAX_LENGTH = 24
+SCHEMA_ENUM_MAX_VALUES = 6
+SCHEMA_TEXT_TYPES = {'char', 'nchar', 'varchar', 'nvarchar'}
+SCHEMA_SAMPLE_COLUMN_MAX_LENGTH = 100  # Colonnes texte plus larges : pas d'exemples
+# Types jamais lus pour l'exemple de TestConnection (volumineux ou binaires)
+SCHEMA_EXAMPLE_SKIPPED_TYPES = {
+    'text', 'ntext', 'image', 'xml', 'binary', 'varbinary', 'timestamp', 'rowversion',
+    'sql_variant', 'geography', 'geometry', 'hierarchyid'
+}
+OPENAI_TOKENIZER_MODEL = "gpt-4"
+
+token_encoder = None
+
 # Global variable to store dynamic DB config
 current_db_config = None
 
-def connect_to_database(db_config, retries=3):
+# Registre nommé de configurations (mode fan-out multi-bases)
+db_registry = {}
+
+# Cache des empreintes/schémas par base du registre (même durée que schema_cache)
+registry_schema_cache = {}
+
+# Paramètres du mode fan-out
+FANOUT_DEFAULT_TIMEOUT = 30  # secondes par base cible
+FANOUT_MAX_TIMEOUT = 600
+# Le serveur annule l'instruction avant l'abandon côté client (le commit doit tenir dans la marge)
+FANOUT_TIMEOUT_MARGIN_SECONDS = 2
+FANOUT_MAX_WORKERS = 32
+
+# Paramétrage automatique des littéraux (réutilisation des plans côté SQL Server)
+PARAMETERIZE_SQL = os.getenv("SQL_PARAMETERIZATION", "on").lower() != "off"
+PARAMETERIZE_MAX_PARAMS = 2000  # SQL Server accepte au plus 2100 paramètres
+# Erreurs où le serveur/pilote refuse la forme paramétrée (syntaxe, nombre ou type de paramètres)
+PARAMETERIZE_FALLBACK_SQLSTATES = {'42000', '07002', 'HY004', 'HYC00'}
+PLAN_STATS_MAX_TEMPLATES = 1000
+
+plan_cache_stats = {
+    "executions": 0,
+    "parameterized": 0,
+    "fallbacks": 0,
+    "untracked": 0,
+    "templates": {}
+}
+plan_stats_lock = threading.Lock()
+
+# Profilage des requêtes (opt-in : SQL_PROFILING=on ou 'profile': true dans /chat)
+SQL_PROFILING = os.getenv("SQL_PROFILING", "off").lower() == "on"
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "500"))
+SLOW_QUERY_LOG_PATH = os.getenv(
+    "SLOW_QUERY_LOG_PATH", os.path.join(tempfile.gettempdir(), "sql-assistant-slow-queries.log")
+)
+SLOW_QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024
+SLOW_QUERY_LOG_BACKUPS = 3
+
+slow_query_logger = None
+slow_query_logger_lock = threading.Lock()
+
+# Pool applicatif de connexions (par chaîne de connexion)
+POOL_MAX_IDLE = int(os.getenv("SQL_POOL_MAX_IDLE", "4"))
+POOL_PING_AFTER_SECONDS = 60
+POOL_MAX_IDLE_SECONDS = 1500  # sous le timeout d'inactivité de la passerelle Azure SQL (30 min)
+# Seules les connexions ayant exécuté ces instructions, sans changement de session, retournent au pool
+SESSION_NEUTRAL_OPERATIONS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'}
+SESSION_STATE_PATTERN = re.compile(
+    r"(?:^|;)\s*(?:USE|SET|BEGIN|COMMIT|ROLLBACK|SAVE|DECLARE|CREATE|ALTER|DROP|EXEC|EXECUTE)\b"
+    r"|\bINTO\s+#",
+    re.IGNORECASE
+)
+
+connection_pools = {}
+connection_pool_lock = threading.Lock()
+
+# SELECT les plus fréquents par base, rejoués par le préchauffage
+HOT_QUERIES_MAX_TRACKED = 200
+
+hot_queries = {}
+hot_queries_lock = threading.Lock()
+
+# Préchauffage périodique (timer) : connexions, schéma, client OpenAI, requêtes fréquentes
+PREWARM_SCHEDULE = os.getenv("PREWARM_SCHEDULE", "0 */4 * * * *")
+PREWARM_BUDGET_MS = float(os.getenv("PREWARM_BUDGET_MS", "5000"))
+PREWARM_QUIET_SECONDS = float(os.getenv("PREWARM_QUIET_SECONDS", "60"))
+PREWARM_SCHEMA_MARGIN_SECONDS = float(os.getenv("PREWARM_SCHEMA_MARGIN_SECONDS", "90"))
+PREWARM_OPENAI = os.getenv("PREWARM_OPENAI", "on").lower() != "off"
+PREWARM_DEFAULTS = {
+    "enabled": True,
+    "min_connections": int(os.getenv("PREWARM_MIN_CONNECTIONS", "1")),
+    "refresh_schema": True,
+    "hot_queries": int(os.getenv("PREWARM_HOT_QUERIES", "0"))
+}
+
+# Trafic en cours (le préchauffage s'efface devant les requêtes utilisateurs)
+live_traffic = {"in_flight": 0, "last_request": 0.0}
+live_traffic_lock = threading.Lock()
+
+# Budget mémoire de matérialisation des résultats (par appel) et bascule sur disque
+RESULT_MEMORY_BUDGET_BYTES = int(float(os.getenv("RESULT_MEMORY_BUDGET_MB", "64")) * 1024 * 1024)
+RESULT_FETCH_BATCH = 500
+RESULT_INLINE_ROWS = 1000  # lignes renvoyées directement quand le résultat est sur disque
+RESULT_PAGE_MAX_ROWS = 5000
+# Export JSONL en un bloc : tampon + copie faite par HttpResponse, bien sous le budget mémoire
+RESULT_EXPORT_MAX_BYTES = RESULT_MEMORY_BUDGET_BYTES // 4
+# Au-delà, la lecture est annulée et le résultat marqué tronqué (disque local limité)
+RESULT_SPILL_MAX_BYTES = int(float(os.getenv("RESULT_SPILL_MAX_MB", "256")) * 1024 * 1024)
+RESULT_SPILL_TTL_SECONDS = 900
+RESULT_SPILL_DIR = os.getenv(
+    "RESULT_SPILL_DIR", os.path.join(tempfile.gettempdir(), "sql-assistant-results")
+)
+
+spilled_results = {}
+spilled_results_lock = threading.Lock()
+result_memory_stats = {"spill_events": 0, "spilled_rows": 0, "spilled_bytes": 0}
+
+# Client Azure OpenAI partagé (réutilise les connexions HTTP entre requêtes)
+OPENAI_KEEPALIVE_SECONDS = 300
+openai_client = None
+openai_client_lock = threading.Lock()
+
+def connect_to_database(db_config, retries=3, login_timeout=30):
     """Connexion robuste à la base avec retry automatique"""
     for attempt in range(retries):
         try:
@@ -34,7 +173,7 @@ def connect_to_database(db_config, retries=3):
                 f"TrustServerCertificate=yes;"
                 f"Connection Timeout=30;"
                 f"CommandTimeout=30;",
-                timeout=30
+                timeout=login_timeout
             )
             
             # Test rapide de la connexion
@@ -57,6 +196,141 @@ def connect_to_database(db_config, retries=3):
     
     return None
 
+def parse_db_config(req_body):
+    """Valide les champs de connexion d'un body JSON, retourne (config, message d'erreur)"""
+    required_fields = ['server', 'database', 'username', 'password']
+    for field in required_fields:
+        if field not in req_body or not req_body[field].strip():
+            return None, f"Missing or empty required field: {field}"
+    
+    db_config = {
+        'server': req_body['server'].strip(),
+        'database': req_body['database'].strip(),
+        'username': req_body['username'].strip(),
+        'password': req_body['password'].strip()
+    }
+    
+    # Réglages optionnels du préchauffage pour cette base
+    if req_body.get('prewarm') is not None:
+        if not isinstance(req_body['prewarm'], dict):
+            return None, "Invalid field: prewarm (must be an object)"
+        prewarm = {}
+        for key, value in req_body['prewarm'].items():
+            if key not in PREWARM_DEFAULTS:
+                continue
+            if isinstance(PREWARM_DEFAULTS[key], bool):
+                if not isinstance(value, bool):
+                    return None, f"Invalid field: prewarm.{key} (must be true or false)"
+            elif isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                return None, f"Invalid field: prewarm.{key} (must be a non-negative integer)"
+            elif key == 'min_connections' and value > POOL_MAX_IDLE:
+                return None, f"Invalid field: prewarm.min_connections (at most {POOL_MAX_IDLE}, the pool size)"
+            prewarm[key] = value
+        db_config['prewarm'] = prewarm
+    
+    return db_config, None
+
+def build_connection_string(db_config):
+    return (
+        f"DRIVER={{ODBC Driver 18 for SQL Server}};"
+        f"SERVER={db_config['server']};"
+        f"DATABASE={db_config['database']};"
+        f"UID={db_config['username']};"
+        f"PWD={db_config['password']};"
+        f"TrustServerCertificate=yes;"
+        f"Connection Timeout=30;"
+    )
+
+def get_pool_key(db_config):
+    return hashlib.sha1(build_connection_string(db_config).encode("utf-8")).hexdigest()
+
+def acquire_connection(db_config, connect_timeout=30):
+    """Prend une connexion inactive du pool (vérifiée si inactive depuis longtemps) ou en ouvre une"""
+    pool_key = get_pool_key(db_config)
+    while True:
+        with connection_pool_lock:
+            idle = connection_pools.get(pool_key)
+            conn, last_used = idle.pop() if idle else (None, 0)
+        
+        if conn is None:
+            return pyodbc.connect(build_connection_string(db_config), timeout=connect_timeout)
+        
+        idle_seconds = time.time() - last_used
+        if idle_seconds > POOL_MAX_IDLE_SECONDS:
+            close_quietly(conn)
+            continue
+        if idle_seconds > POOL_PING_AFTER_SECONDS:
+            try:
+                conn.cursor().execute("SELECT 1").fetchone()
+            except pyodbc.Error:
+                close_quietly(conn)
+                continue
+        return conn
+
+def is_session_neutral(sql_query):
+    """Vrai si la requête ne peut pas laisser d'état sur la session (connexion réutilisable)"""
+    words = sql_query.lstrip().split(None, 1)
+    return (
+        bool(words) and words[0].upper() in SESSION_NEUTRAL_OPERATIONS
+        and not SESSION_STATE_PATTERN.search(sql_query)
+    )
+
+def seconds_before(deadline, cap, margin=0):
+    """Secondes entières disponibles avant deadline (moins la marge), plafonnées à cap.
+    Sans deadline, retourne cap ; un résultat < 1 signifie que le délai est écoulé."""
+    if deadline is None:
+        return cap
+    return min(cap, math.floor(deadline - time.time() - margin))
+
+def parse_timeout(value):
+    """Timeout en secondes d'une requête HTTP : nombre fini dans ]0, FANOUT_MAX_TIMEOUT], sinon None"""
+    if isinstance(value, bool):
+        return None
+    try:
+        timeout = float(value)
+    except (TypeError, ValueError):
+        return None
+    return timeout if 0 < timeout <= FANOUT_MAX_TIMEOUT else None
+
+def release_connection(db_config, conn):
+    """Remet une connexion saine dans le pool, ou la ferme si le pool est plein"""
+    pool_key = get_pool_key(db_config)
+    conn.timeout = 0  # Pas de délai d'annulation hérité d'un appel précédent
+    with connection_pool_lock:
+        idle = connection_pools.setdefault(pool_key, [])
+        if len(idle) < POOL_MAX_IDLE:
+            idle.append((conn, time.time()))
+            return
+    close_quietly(conn)
+
+def discard_connection(conn):
+    """Abandonne une connexion après une erreur (état de session incertain)"""
+    if conn is None:
+        return
+    try:
+        conn.rollback()
+    except pyodbc.Error:
+        pass
+    close_quietly(conn)
+
+def close_quietly(conn):
+    try:
+        conn.close()
+    except pyodbc.Error:
+        pass
+
+def record_hot_query(db_config, template_key, sql_text, params, input_sizes):
+    """Mémorise les SELECT les plus fréquents par base (rejoués par le préchauffage)"""
+    with hot_queries_lock:
+        queries = hot_queries.setdefault(get_pool_key(db_config), {})
+        entry = queries.get(template_key)
+        if entry is None:
+            if len(queries) >= HOT_QUERIES_MAX_TRACKED:
+                return
+            entry = queries[template_key] = {"count": 0}
+        entry.update(sql=sql_text, params=params, input_sizes=input_sizes)
+        entry["count"] += 1
+
 def parse_multiple_sql_queries(sql_text):
     """Parse multiple SQL queries from text, handling various separators"""
     if not sql_text or not sql_text.strip():
@@ -128,9 +402,654 @@ def parse_multiple_sql_queries(sql_text):
     
     return final_queries
 
-def execute_sql_query(sql_query, db_config):
-    """Exécute une requête SQL et retourne les résultats"""
+# Types SQL dont les arguments entre parenthèses doivent rester des constantes
+SQL_TYPES_WITH_LENGTH = {
+    'CHAR', 'NCHAR', 'VARCHAR', 'NVARCHAR', 'BINARY', 'VARBINARY',
+    'DECIMAL', 'NUMERIC', 'FLOAT', 'TIME', 'DATETIME2', 'DATETIMEOFFSET'
+}
+
+# Contextes dont les arguments numériques restent en dur (ex: style de CONVERT, OPTION (MAXDOP 1))
+SQL_CONSTANT_ARGUMENT_CONTEXTS = {'CONVERT', 'TRY_CONVERT', 'OPTION', 'TABLESAMPLE'}
+
+# Mots-clés qui terminent une clause ORDER BY / GROUP BY (où 1, 2... sont des positions)
+SQL_CLAUSE_KEYWORDS = {
+    'SELECT', 'FROM', 'WHERE', 'HAVING', 'UNION', 'EXCEPT', 'INTERSECT',
+    'OFFSET', 'FETCH', 'FOR', 'OPTION'
+}
+
+def parameterize_sql(sql_query):
+    """Remplace les littéraux d'une requête DML par des paramètres '?'.
+    
+    Retourne (requête paramétrée, paramètres, tailles d'entrée) ou None si la requête
+    doit être envoyée telle quelle (DDL, variables, contexte où un littéral est requis).
+    Les tailles fixes (varchar 8000 / nvarchar 4000) évitent qu'une longueur de valeur
+    différente ne produise un nouveau plan.
+    """
+    words = sql_query.lstrip().split(None, 1)
+    if not words or words[0].upper() not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+        return None
+    
+    output = []
+    params = []
+    input_sizes = []
+    paren_stack = []
+    previous_word = ''
+    previous_token = ''
+    ordinal_clause = None
+    i = 0
+    length = len(sql_query)
+    
+    while i < length:
+        char = sql_query[i]
+        
+        # Chaînes : 'abc', N'abc' (quotes doublées échappées)
+        if char == "'" or (char in 'Nn' and sql_query[i+1:i+2] == "'"
+                           and not (output and (output[-1][-1:].isalnum() or output[-1][-1:] == '_'))):
+            unicode_literal = char in 'Nn'
+            start = i + 2 if unicode_literal else i + 1
+            j = start
+            value_parts = []
+            while True:
+                end = sql_query.find("'", j)
+                if end == -1:
+                    return None  # Chaîne non fermée
+                value_parts.append(sql_query[j:end])
+                if sql_query[end+1:end+2] == "'":
+                    value_parts.append("'")
+                    j = end + 2
+                    continue
+                break
+            value = "".join(value_parts)
+            if ordinal_clause == 'GROUP':
+                return None  # L'expression du GROUP BY doit rester identique à celle du SELECT
+            if ordinal_clause == 'ORDER' or previous_token in ('ESCAPE', 'AS'):
+                # ORDER BY 'x', LIKE ... ESCAPE '!' et alias AS 'Total' restent en dur
+                output.append(sql_query[i:end+1])
+            else:
+                output.append("?")
+                params.append(value)
+                if unicode_literal:
+                    input_sizes.append((pyodbc.SQL_WVARCHAR, 4000 if len(value) <= 4000 else 0, 0))
+                else:
+                    input_sizes.append((pyodbc.SQL_VARCHAR, 8000 if len(value) <= 8000 else 0, 0))
+            previous_token = 'LITERAL'
+            i = end + 1
+            continue
+        
+        # Identifiants délimités [abc] / "abc" et commentaires : recopiés tels quels
+        if char in '["':
+            closing = ']' if char == '[' else '"'
+            end = sql_query.find(closing, i + 1)
+            while end != -1 and sql_query[end+1:end+2] == closing:
+                end = sql_query.find(closing, end + 2)
+            if end == -1:
+                return None
+            output.append(sql_query[i:end+1])
+            previous_token = 'IDENTIFIER'
+            i = end + 1
+            continue
+        if sql_query.startswith('--', i):
+            end = sql_query.find('\n', i)
+            end = length if end == -1 else end
+            output.append(sql_query[i:end])
+            i = end
+            continue
+        if sql_query.startswith('/*', i):
+            end = sql_query.find('*/', i + 2)
+            if end == -1:
+                return None
+            output.append(sql_query[i:end+2])
+            i = end + 2
+            continue
+        
+        # Mots (mots-clés, identifiants, fonctions)
+        if char.isalpha() or char in '_@#':
+            j = i + 1
+            while j < length and (sql_query[j].isalnum() or sql_query[j] in '_@#$'):
+                j += 1
+            word = sql_query[i:j]
+            if word.startswith('@') or word.upper() == 'DECLARE':
+                return None  # Lot avec variables : on ne touche à rien
+            upper_word = word.upper()
+            if upper_word == 'BY' and previous_word in ('ORDER', 'GROUP'):
+                ordinal_clause = previous_word
+            elif upper_word in SQL_CLAUSE_KEYWORDS:
+                ordinal_clause = None
+            output.append(word)
+            previous_word = upper_word
+            previous_token = upper_word
+            i = j
+            continue
+        
+        # Nombres
+        if char.isdigit() or (char == '.' and sql_query[i+1:i+2].isdigit()):
+            match = re.match(r'0[xX][0-9a-fA-F]*|\d*\.?\d+(?:[eE][+-]?\d+)?\.?', sql_query[i:])
+            literal = match.group(0)
+            if ordinal_clause == 'GROUP':
+                return None
+            constant_context = (
+                previous_token == 'TOP'
+                or (previous_token == '(' and previous_word == 'TOP')
+                or ordinal_clause == 'ORDER'
+                or (paren_stack and paren_stack[-1][0])
+            )
+            is_int = literal.isdigit() and int(literal) <= 2147483647
+            if is_int and not constant_context:
+                output.append("?")
+                params.append(int(literal))
+                input_sizes.append((pyodbc.SQL_INTEGER, 0, 0))
+            else:
+                # Décimaux et hexadécimaux restent en dur (type/précision dépendants de la valeur)
+                output.append(literal)
+            previous_token = 'LITERAL'
+            i += len(literal)
+            continue
+        
+        if char == '?':
+            return None  # Déjà paramétrée
+        if char == '(':
+            # La clause englobante est sauvegardée puis restaurée à la fermeture : un ORDER BY /
+            # GROUP BY de sous-requête ou de OVER (...) ne déborde pas sur la suite
+            paren_stack.append((
+                previous_token in SQL_TYPES_WITH_LENGTH
+                or previous_token in SQL_CONSTANT_ARGUMENT_CONTEXTS,
+                ordinal_clause
+            ))
+            if previous_token != 'TOP':
+                previous_word = ''
+        elif char == ')' and paren_stack:
+            ordinal_clause = paren_stack.pop()[1]
+        
+        output.append(char)
+        if not char.isspace():
+            previous_token = char
+        i += 1
+    
+    if not params or len(params) > PARAMETERIZE_MAX_PARAMS:
+        return None
+    
+    return "".join(output), params, input_sizes
+
+def record_plan_usage(sql_text, parameterized, fallback=False):
+    """Comptabilise l'utilisation d'un texte SQL (un texte distinct = un plan côté serveur).
+    Retourne la clé du texte normalisé."""
+    template_key = hashlib.sha1(" ".join(sql_text.split()).encode("utf-8")).hexdigest()
+    with plan_stats_lock:
+        plan_cache_stats["executions"] += 1
+        if parameterized:
+            plan_cache_stats["parameterized"] += 1
+        if fallback:
+            plan_cache_stats["fallbacks"] += 1
+        
+        templates = plan_cache_stats["templates"]
+        if template_key in templates:
+            templates[template_key] += 1
+        elif len(templates) < PLAN_STATS_MAX_TEMPLATES:
+            templates[template_key] = 1
+        else:
+            plan_cache_stats["untracked"] += 1
+    return template_key
+
+def get_plan_reuse_stats():
+    """Statistiques locales de réutilisation des textes SQL envoyés au serveur"""
+    with plan_stats_lock:
+        executions = plan_cache_stats["executions"]
+        templates = plan_cache_stats["templates"]
+        distinct = len(templates)
+        single_use = sum(1 for count in templates.values() if count == 1)
+        return {
+            "parameterization_enabled": PARAMETERIZE_SQL,
+            "executions": executions,
+            "parameterized": plan_cache_stats["parameterized"],
+            "fallbacks": plan_cache_stats["fallbacks"],
+            "distinct_statements": distinct,
+            "single_use_statements": single_use,
+            "untracked_executions": plan_cache_stats["untracked"],
+            "reuse_ratio": round(1 - distinct / executions, 4) if executions else 0
+        }
+
+def get_server_plan_cache_stats(db_config):
+    """Résumé du cache de plans côté serveur (nécessite VIEW DATABASE STATE)"""
+    conn = connect_to_database(db_config, retries=1)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT cp.objtype,
+                   COUNT(*) AS plans,
+                   SUM(CASE WHEN cp.usecounts = 1 THEN 1 ELSE 0 END) AS single_use_plans,
+                   SUM(CAST(cp.usecounts AS BIGINT)) AS total_use_counts,
+                   SUM(CAST(cp.size_in_bytes AS BIGINT)) / 1024 AS size_kb
+            FROM sys.dm_exec_cached_plans cp
+            WHERE cp.cacheobjtype = 'Compiled Plan' AND cp.objtype IN ('Adhoc', 'Prepared')
+            GROUP BY cp.objtype
+        """)
+        return {
+            row[0]: {
+                "plans": row[1],
+                "single_use_plans": row[2],
+                "total_use_counts": row[3],
+                "size_kb": row[4]
+            }
+            for row in cursor.fetchall()
+        }
+    finally:
+        conn.close()
+
+SHOWPLAN_NS = {"sp": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+
+def enable_query_profiling(cursor):
+    """Active STATISTICS IO/TIME et, si la permission SHOWPLAN est accordée, le plan réel"""
+    cursor.execute("SET STATISTICS IO ON; SET STATISTICS TIME ON;")
+    try:
+        cursor.execute("SET STATISTICS XML ON;")
+        # Sans permission SHOWPLAN, l'erreur (Msg 262) n'apparaît qu'à l'instruction suivante
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        return True
+    except pyodbc.Error as e:
+        logging.warning(f"⚠️ Plan réel non disponible (permission SHOWPLAN ?): {e}")
+        try:
+            cursor.execute("SET STATISTICS XML OFF;")
+        except pyodbc.Error:
+            pass
+        return False
+
+def disable_query_profiling(cursor):
+    cursor.execute("SET STATISTICS XML OFF; SET STATISTICS IO OFF; SET STATISTICS TIME OFF;")
+
+def parse_statistics_messages(messages):
+    """Extrait lectures logiques/physiques et temps CPU/écoulé des messages STATISTICS IO/TIME"""
+    text = "\n".join(messages)
+    tables = {}
+    for match in re.finditer(
+        r"Table '([^']+)'\. Scan count (\d+), logical reads (\d+), physical reads (\d+)"
+        r"(?:.*?read-ahead reads (\d+))?", text
+    ):
+        table = tables.setdefault(match.group(1), {
+            "table": match.group(1), "scan_count": 0, "logical_reads": 0,
+            "physical_reads": 0, "read_ahead_reads": 0
+        })
+        table["scan_count"] += int(match.group(2))
+        table["logical_reads"] += int(match.group(3))
+        table["physical_reads"] += int(match.group(4))
+        table["read_ahead_reads"] += int(match.group(5) or 0)
+    
+    compile_times = re.findall(
+        r"parse and compile time:\s*CPU time = (\d+) ms,\s*elapsed time = (\d+) ms", text
+    )
+    execution_times = re.findall(
+        r"Execution Times:\s*CPU time = (\d+) ms,\s*elapsed time = (\d+) ms", text
+    )
+    return {
+        "logical_reads": sum(t["logical_reads"] for t in tables.values()),
+        "physical_reads": sum(t["physical_reads"] for t in tables.values()),
+        "tables_io": list(tables.values()),
+        "compile_cpu_ms": sum(int(cpu) for cpu, _ in compile_times),
+        "compile_elapsed_ms": sum(int(elapsed) for _, elapsed in compile_times),
+        "cpu_time_ms": sum(int(cpu) for cpu, _ in execution_times),
+        "elapsed_time_ms": sum(int(elapsed) for _, elapsed in execution_times)
+    }
+
+def summarize_showplan(plan_xml, max_operators=15):
+    """Résumé du plan réel : coût, parallélisme, opérateurs, avertissements, tables"""
+    root = ElementTree.fromstring(plan_xml)
+    statement = root.find(".//sp:StmtSimple", SHOWPLAN_NS)
+    query_plan = root.find(".//sp:QueryPlan", SHOWPLAN_NS)
+    
+    operators = []
+    for rel_op in root.iter(f"{{{SHOWPLAN_NS['sp']}}}RelOp"):
+        actual_rows = [
+            int(counter.get("ActualRows", 0))
+            for counter in rel_op.findall("sp:RunTimeInformation/sp:RunTimeCountersPerThread", SHOWPLAN_NS)
+        ]
+        obj = rel_op.find("./*/sp:Object", SHOWPLAN_NS)
+        operators.append({
+            "physical_op": rel_op.get("PhysicalOp"),
+            "logical_op": rel_op.get("LogicalOp"),
+            "estimated_rows": float(rel_op.get("EstimateRows", 0)),
+            "actual_rows": sum(actual_rows) if actual_rows else None,
+            "object": ".".join(
+                obj.get(part) for part in ("Schema", "Table", "Index") if obj.get(part)
+            ) if obj is not None else None
+        })
+    
+    warnings = sorted({
+        child.tag.split("}")[-1]
+        for element in root.iter(f"{{{SHOWPLAN_NS['sp']}}}Warnings")
+        for child in element
+    } | {
+        name for element in root.iter(f"{{{SHOWPLAN_NS['sp']}}}Warnings")
+        for name, value in element.attrib.items() if value in ("true", "1")
+    })
+    
+    tables = sorted({
+        f"{obj.get('Schema')}.{obj.get('Table')}"
+        for obj in root.iter(f"{{{SHOWPLAN_NS['sp']}}}Object")
+        if obj.get("Table") and obj.get("Schema") and not obj.get("Table").startswith("[#")
+    })
+    
+    memory_grant = root.find(".//sp:MemoryGrantInfo", SHOWPLAN_NS)
+    return {
+        "estimated_cost": float(statement.get("StatementSubTreeCost", 0)) if statement is not None else None,
+        "degree_of_parallelism": int(query_plan.get("DegreeOfParallelism", 1)) if query_plan is not None else None,
+        "granted_memory_kb": int(memory_grant.get("GrantedMemory", 0)) if memory_grant is not None else None,
+        "operator_count": len(operators),
+        "operators": operators[:max_operators],
+        "warnings": warnings,
+        "tables": tables
+    }
+
+def capture_query_profile(cursor, sql_query, plan_enabled):
+    """Lit les messages et le plan restants après la requête, puis désactive le profilage"""
+    messages = [message[1] for message in (cursor.messages or [])]
+    plan_xml = None
+    try:
+        while cursor.nextset():
+            messages.extend(message[1] for message in (cursor.messages or []))
+            if cursor.description and "showplan" in cursor.description[0][0].lower():
+                row = cursor.fetchone()
+                if row and row[0]:
+                    plan_xml = row[0]
+    except pyodbc.Error as e:
+        logging.warning(f"⚠️ Lecture du profil incomplète: {e}")
+    
+    profile = parse_statistics_messages(messages)
+    profile["plan"] = None
+    if plan_enabled and plan_xml:
+        try:
+            profile["plan"] = summarize_showplan(plan_xml)
+        except ElementTree.ParseError as e:
+            logging.warning(f"⚠️ Plan XML illisible: {e}")
+    
+    # Tables concernées : celles du plan, à défaut celles citées dans la requête
+    tables = profile["plan"]["tables"] if profile["plan"] else [
+        ".".join(part.strip("[]") for part in match.split("."))
+        for match in re.findall(
+            r"\b(?:FROM|JOIN|INTO|UPDATE)\s+((?:\[[^\]]+\]|\w+)(?:\.(?:\[[^\]]+\]|\w+))?)",
+            sql_query, re.IGNORECASE
+        )
+    ]
+    try:
+        disable_query_profiling(cursor)
+        profile["session_reset"] = True
+    except pyodbc.Error as e:
+        logging.warning(f"⚠️ Désactivation du profilage impossible: {e}")
+        profile["session_reset"] = False
+    profile["missing_indexes"] = get_missing_index_suggestions(cursor, tables) if profile["session_reset"] else []
+    return profile
+
+def release_query_connection(db_config, conn, sql_query, query_profile):
+    """Remet la connexion dans le pool, sauf si la requête a pu modifier l'état de session
+    (USE, SET, transaction, table temporaire...) ou si les STATISTICS sont restées actives"""
+    profiling_left_on = query_profile is not None and not query_profile.pop("session_reset")
+    if profiling_left_on or not is_session_neutral(sql_query):
+        discard_connection(conn)
+    else:
+        release_connection(db_config, conn)
+
+def get_missing_index_suggestions(cursor, tables):
+    """Suggestions de sys.dm_db_missing_index_details pour les tables de la requête"""
+    suggestions = []
+    for table in sorted(set(tables)):
+        try:
+            cursor.execute("""
+                SELECT TOP 3 d.statement, d.equality_columns, d.inequality_columns, d.included_columns,
+                       s.user_seeks, s.user_scans, s.avg_total_user_cost, s.avg_user_impact
+                FROM sys.dm_db_missing_index_details d
+                JOIN sys.dm_db_missing_index_groups g ON g.index_handle = d.index_handle
+                JOIN sys.dm_db_missing_index_group_stats s ON s.group_handle = g.index_group_handle
+                WHERE d.database_id = DB_ID() AND d.object_id = OBJECT_ID(?)
+                ORDER BY s.avg_total_user_cost * s.avg_user_impact * (s.user_seeks + s.user_scans) DESC
+            """, (table,))
+            rows = cursor.fetchall()
+        except pyodbc.Error as e:
+            logging.warning(f"⚠️ Index manquants non accessibles (VIEW DATABASE STATE requis): {e}")
+            break
+        
+        for statement, equality, inequality, included, seeks, scans, cost, impact in rows:
+            key_columns = ", ".join(c for c in (equality, inequality) if c)
+            suggestion = f"CREATE INDEX ... ON {statement} ({key_columns})"
+            if included:
+                suggestion += f" INCLUDE ({included})"
+            suggestions.append({
+                "table": table,
+                "equality_columns": equality,
+                "inequality_columns": inequality,
+                "included_columns": included,
+                "user_seeks": seeks,
+                "user_scans": scans,
+                "avg_total_user_cost": cost,
+                "avg_user_impact_pct": impact,
+                "suggested_index": suggestion
+            })
+    return suggestions
+
+def get_slow_query_logger():
+    """Journal local rotatif des requêtes lentes (une ligne JSON par requête)"""
+    global slow_query_logger
+    with slow_query_logger_lock:
+        if slow_query_logger is None:
+            handler = RotatingFileHandler(
+                SLOW_QUERY_LOG_PATH,
+                maxBytes=SLOW_QUERY_LOG_MAX_BYTES,
+                backupCount=SLOW_QUERY_LOG_BACKUPS,
+                encoding="utf-8"
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger = logging.getLogger("sql_assistant.slow_queries")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.addHandler(handler)
+            slow_query_logger = logger
+        return slow_query_logger
+
+def log_slow_query(question, db_config, query_result):
+    try:
+        get_slow_query_logger().info(json.dumps({
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "question": question,
+            "server": db_config.get('server'),
+            "database": db_config.get('database'),
+            "sql_query": query_result["sql_query"],
+            "operation": query_result.get("operation"),
+            "execution_time_ms": query_result.get("execution_time_ms"),
+            "row_count": query_result.get("row_count"),
+            "profile": query_result.get("profile")
+        }, default=str))
+    except OSError as e:
+        logging.warning(f"⚠️ Écriture du journal des requêtes lentes impossible: {e}")
+
+class SpilledResult:
+    """Tampon disque d'un résultat SELECT trop gros pour la mémoire.
+
+    Une ligne JSON compacte (tableau de valeurs) par ligne de résultat, et un index
+    des positions de fin (uint64) à côté. Les deux fichiers sont lus par mmap : une
+    page ou un export est un découpage d'octets, sans recréer d'objets Python.
+    """
+
+    def __init__(self, columns):
+        os.makedirs(RESULT_SPILL_DIR, exist_ok=True)
+        self.result_id = uuid.uuid4().hex
+        self.columns = columns
+        self.data_path = os.path.join(RESULT_SPILL_DIR, f"{self.result_id}.jsonl")
+        self.index_path = os.path.join(RESULT_SPILL_DIR, f"{self.result_id}.idx")
+        self.row_count = 0
+        self.size_bytes = 0
+        self.created_at = time.time()
+        self.truncated = False
+        self._data_file = open(self.data_path, "wb")
+        self._index_file = open(self.index_path, "wb")
+
+    def append(self, values):
+        line = json.dumps(values, default=str, separators=(",", ":")).encode("utf-8") + b"\n"
+        self._data_file.write(line)
+        self.size_bytes += len(line)
+        self._index_file.write(struct.pack("<Q", self.size_bytes))
+        self.row_count += 1
+
+    def finish(self):
+        self._data_file.close()
+        self._index_file.close()
+
+    def _byte_range(self, offset, limit):
+        """Positions [début, fin) des lignes offset..offset+limit dans le fichier de données"""
+        end_row = min(offset + limit, self.row_count)
+        if offset >= end_row:
+            return 0, 0
+        with open(self.index_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as index:
+            start = struct.unpack_from("<Q", index, (offset - 1) * 8)[0] if offset > 0 else 0
+            end = struct.unpack_from("<Q", index, (end_row - 1) * 8)[0]
+        return start, end
+
+    def read_rows_json(self, offset, limit):
+        """Page de lignes sous forme de tableau JSON (octets), lue directement depuis le disque"""
+        start, end = self._byte_range(offset, limit)
+        if start == end:
+            return b"[]"
+        with open(self.data_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            chunk = data[start:end]
+        return b"[" + chunk[:-1].replace(b"\n", b",") + b"]"
+
+    def read_jsonl(self):
+        """Export complet : en-tête des colonnes puis une ligne JSON par ligne de résultat.
+        Le tampon est alloué une seule fois et rempli directement depuis le fichier
+        (HttpResponse en fait ensuite sa propre copie, d'où RESULT_EXPORT_MAX_BYTES)."""
+        header = json.dumps({"columns": self.columns}).encode("utf-8") + b"\n"
+        body = bytearray(len(header) + self.size_bytes)
+        body[:len(header)] = header
+        view = memoryview(body)[len(header):]
+        with open(self.data_path, "rb") as f:
+            while view:
+                read = f.readinto(view)
+                if not read:
+                    raise OSError(f"Fichier de résultat tronqué: {self.data_path}")
+                view = view[read:]
+        return body
+
+    def delete(self):
+        for path in (self.data_path, self.index_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def new_result_budget():
+    """Budget mémoire de matérialisation des résultats, partagé par les requêtes d'un appel"""
+    return {"limit_bytes": RESULT_MEMORY_BUDGET_BYTES, "used_bytes": 0, "peak_bytes": 0, "spill_events": 0}
+
+def estimate_row_bytes(values):
+    """Estimation de l'empreinte d'une ligne convertie en dict (objets Python + texte JSON)"""
+    size = 240 + 72 * len(values)
+    for value in values:
+        if isinstance(value, str):
+            size += 2 * len(value)
+    return size
+
+def convert_result_value(value):
+    if value is None or isinstance(value, (int, float, str, bool)):
+        return value
+    return str(value)
+
+def materialize_select_rows(cursor, columns, budget):
+    """Lit un SELECT par lots en respectant le budget mémoire de la requête.
+
+    Tant que le budget tient, les lignes sont gardées en dicts. Au dépassement,
+    toutes les lignes partent dans un SpilledResult et seules les RESULT_INLINE_ROWS
+    premières restent en mémoire pour la réponse. Si le fichier atteint
+    RESULT_SPILL_MAX_BYTES, la requête est annulée et le spill marqué tronqué.
+    Retourne (lignes en mémoire, spill).
+    """
+    column_names = [columns[i] if i < len(columns) else f"column_{i}" for i in range(len(columns))]
+    # Colonnes en double (ex: SELECT * sur une jointure) : même fusion que les dicts en mémoire
+    has_duplicate_columns = len(set(column_names)) != len(column_names)
+    results = []
+    row_sizes = []
+    spill = None
+    
+    try:
+        while True:
+            rows = cursor.fetchmany(RESULT_FETCH_BATCH)
+            if not rows:
+                break
+            for row in rows:
+                values = [convert_result_value(value) for value in row]
+                if spill is not None:
+                    if has_duplicate_columns:
+                        values = list(dict(zip(column_names, values)).values())
+                    spill.append(values)
+                    if spill.size_bytes >= RESULT_SPILL_MAX_BYTES:
+                        break
+                    continue
+                
+                row_size = estimate_row_bytes(values)
+                results.append(dict(zip(column_names, values)))
+                row_sizes.append(row_size)
+                budget["used_bytes"] += row_size
+                budget["peak_bytes"] = max(budget["peak_bytes"], budget["used_bytes"])
+                
+                if budget["used_bytes"] > budget["limit_bytes"]:
+                    spill = SpilledResult(list(dict.fromkeys(column_names)))
+                    for row_dict in results:
+                        spill.append(list(row_dict.values()))
+                    # Ne garder en mémoire que l'aperçu renvoyé dans la réponse
+                    budget["used_bytes"] -= sum(row_sizes[RESULT_INLINE_ROWS:])
+                    del results[RESULT_INLINE_ROWS:]
+                    row_sizes = None
+                    budget["spill_events"] += 1
+                    logging.warning(
+                        f"💾 Budget mémoire des résultats dépassé "
+                        f"({budget['limit_bytes'] // (1024 * 1024)} Mo), bascule sur disque: {spill.data_path}"
+                    )
+            
+            if spill is not None and spill.size_bytes >= RESULT_SPILL_MAX_BYTES:
+                spill.truncated = True
+                cursor.cancel()
+                logging.warning(
+                    f"✂️ Résultat tronqué à {spill.row_count} lignes "
+                    f"(limite disque de {RESULT_SPILL_MAX_BYTES // (1024 * 1024)} Mo)"
+                )
+                break
+    except BaseException:
+        if spill is not None:
+            spill.finish()
+            spill.delete()
+        raise
+    
+    if spill is not None:
+        spill.finish()
+        register_spilled_result(spill)
+    return results, spill
+
+def register_spilled_result(spill):
+    purge_expired_spills()
+    with spilled_results_lock:
+        spilled_results[spill.result_id] = spill
+        result_memory_stats["spill_events"] += 1
+        result_memory_stats["spilled_rows"] += spill.row_count
+        result_memory_stats["spilled_bytes"] += spill.size_bytes
+
+def purge_expired_spills():
+    """Supprime les tampons disque plus vieux que RESULT_SPILL_TTL_SECONDS"""
+    current_time = time.time()
+    with spilled_results_lock:
+        expired = [
+            spilled_results.pop(result_id)
+            for result_id, spill in list(spilled_results.items())
+            if current_time - spill.created_at > RESULT_SPILL_TTL_SECONDS
+        ]
+    for spill in expired:
+        spill.delete()
+
+def get_spilled_result(result_id):
+    purge_expired_spills()
+    with spilled_results_lock:
+        return spilled_results.get(result_id)
+
+def execute_sql_query(sql_query, db_config, profile=False, budget=None, deadline=None):
+    """Exécute une requête SQL et retourne les résultats.
+    deadline (time.time()) : le serveur annule l'instruction avant cette échéance"""
     start_time = time.time()
+    conn = None
     
     try:
         # Vérifications de sécurité basiques
@@ -151,63 +1070,98 @@ def execute_sql_query(sql_query, db_config):
             if keyword in sql_upper:
                 return f"Erreur: Opération non autorisée - {keyword} détecté"
         
-        # Connexion à la base
-        conn = pyodbc.connect(
-            f"DRIVER={{ODBC Driver 18 for SQL Server}};"
-            f"SERVER={db_config['server']};"
-            f"DATABASE={db_config['database']};"
-            f"UID={db_config['username']};"
-            f"PWD={db_config['password']};"
-            f"TrustServerCertificate=yes;"
-            f"Connection Timeout=30;",
-            timeout=30
-        )
+        # Connexion à la base (réutilisée depuis le pool si possible)
+        connect_timeout = seconds_before(deadline, 30, FANOUT_TIMEOUT_MARGIN_SECONDS)
+        if connect_timeout < 1:
+            return "Erreur: Timeout - délai de la base cible écoulé avant l'exécution"
+        conn = acquire_connection(db_config, connect_timeout=connect_timeout)
+        if deadline is not None:
+            statement_timeout = seconds_before(deadline, FANOUT_MAX_TIMEOUT, FANOUT_TIMEOUT_MARGIN_SECONDS)
+            if statement_timeout < 1:
+                release_connection(db_config, conn)
+                return "Erreur: Timeout - délai de la base cible écoulé avant l'exécution"
+            conn.timeout = statement_timeout
         cursor = conn.cursor()
         
-        # Exécuter la requête
-        cursor.execute(sql_query)
+        # Profilage optionnel : STATISTICS IO/TIME et plan réel
+        plan_enabled = enable_query_profiling(cursor) if profile else False
+        query_profile = None
+        
+        # Exécuter la requête, avec les littéraux passés en paramètres quand c'est possible
+        parameterized = parameterize_sql(sql_query) if PARAMETERIZE_SQL else None
+        parameter_count = 0
+        if parameterized:
+            template, params, input_sizes = parameterized
+            try:
+                cursor.setinputsizes(input_sizes)
+                cursor.execute(template, params)
+                parameter_count = len(params)
+                template_key = record_plan_usage(template, parameterized=True)
+                executed = (template, params, input_sizes)
+            except pyodbc.Error as param_error:
+                # Timeout, contrainte, interblocage... : le texte d'origine échouerait de même
+                if not param_error.args or param_error.args[0] not in PARAMETERIZE_FALLBACK_SQLSTATES:
+                    raise
+                # Repli : renvoyer le texte d'origine tel quel
+                logging.warning(f"⚠️ Requête paramétrée refusée, exécution du texte d'origine: {param_error}")
+                conn.rollback()
+                cursor = conn.cursor()
+                cursor.execute(sql_query)
+                parameterized = None
+                template_key = record_plan_usage(sql_query, parameterized=False, fallback=True)
+                executed = (sql_query, None, None)
+        else:
+            cursor.execute(sql_query)
+            template_key = record_plan_usage(sql_query, parameterized=False)
+            executed = (sql_query, None, None)
         
         # Déterminer le type d'opération
         operation_type = sql_upper.split()[0] if sql_upper else "UNKNOWN"
         
         # Gérer différents types de requêtes
-        if operation_type in ['SELECT']:
-            # Pour SELECT : récupérer les résultats
-            rows = cursor.fetchall()
+        if operation_type in ['SELECT'] or (operation_type == 'WITH' and cursor.description):
+            # Pour SELECT (et WITH ... SELECT) : récupérer les résultats par lots, dans le budget mémoire
             columns = [column[0] for column in cursor.description] if cursor.description else []
+            results, spill = materialize_select_rows(
+                cursor, columns, budget if budget is not None else new_result_budget()
+            )
+            row_count = spill.row_count if spill else len(results)
             
-            results = []
-            for row in rows:
-                row_dict = {}
-                for i, value in enumerate(row):
-                    column_name = columns[i] if i < len(columns) else f"column_{i}"
-                    if value is None:
-                        row_dict[column_name] = None
-                    elif isinstance(value, (int, float, str, bool)):
-                        row_dict[column_name] = value
-                    else:
-                        row_dict[column_name] = str(value)
-                results.append(row_dict)
-            
+            record_hot_query(db_config, template_key, *executed)
             execution_time = round((time.time() - start_time) * 1000, 2)
+            if profile:
+                query_profile = capture_query_profile(cursor, sql_query, plan_enabled)
             conn.commit()
-            conn.close()
+            release_query_connection(db_config, conn, sql_query, query_profile)
             
             return {
                 "operation": "SELECT",
                 "data": results,
-                "count": len(results),
+                "count": row_count,
                 "columns": columns,
                 "execution_time": execution_time,
-                "message": f"Requête exécutée avec succès - {len(results)} lignes retournées"
+                "parameterized": parameterized is not None,
+                "parameter_count": parameter_count,
+                "profile": query_profile,
+                "spill": {
+                    "result_id": spill.result_id,
+                    "rows": spill.row_count,
+                    "bytes": spill.size_bytes,
+                    "inline_rows": len(results),
+                    "truncated": spill.truncated
+                } if spill else None,
+                "message": f"Requête exécutée avec succès - {row_count} lignes retournées"
+                           + (" (résultat tronqué)" if spill and spill.truncated else "")
             }
             
         elif operation_type in ['INSERT', 'UPDATE', 'DELETE']:
             # Pour les modifications : récupérer le nombre de lignes affectées
             affected_rows = cursor.rowcount
             execution_time = round((time.time() - start_time) * 1000, 2)
+            if profile:
+                query_profile = capture_query_profile(cursor, sql_query, plan_enabled)
             conn.commit()
-            conn.close()
+            release_query_connection(db_config, conn, sql_query, query_profile)
             
             return {
                 "operation": operation_type,
@@ -215,20 +1169,28 @@ def execute_sql_query(sql_query, db_config):
                 "count": 0,
                 "affected_rows": affected_rows,
                 "execution_time": execution_time,
+                "parameterized": parameterized is not None,
+                "parameter_count": parameter_count,
+                "profile": query_profile,
                 "message": f"{operation_type} exécuté avec succès - {affected_rows} lignes affectées"
             }
             
         elif operation_type in ['CREATE', 'ALTER', 'DROP']:
             # Pour les modifications de structure
             execution_time = round((time.time() - start_time) * 1000, 2)
+            if profile:
+                query_profile = capture_query_profile(cursor, sql_query, plan_enabled)
             conn.commit()
-            conn.close()
+            release_query_connection(db_config, conn, sql_query, query_profile)
             
             return {
                 "operation": operation_type,
                 "data": [],
                 "count": 0,
                 "execution_time": execution_time,
+                "parameterized": parameterized is not None,
+                "parameter_count": parameter_count,
+                "profile": query_profile,
                 "message": f"{operation_type} exécuté avec succès"
             }
             
@@ -242,8 +1204,10 @@ def execute_sql_query(sql_query, db_config):
                 columns = []
             
             execution_time = round((time.time() - start_time) * 1000, 2)
+            if profile:
+                query_profile = capture_query_profile(cursor, sql_query, plan_enabled)
             conn.commit()
-            conn.close()
+            release_query_connection(db_config, conn, sql_query, query_profile)
             
             return {
                 "operation": operation_type,
@@ -251,19 +1215,25 @@ def execute_sql_query(sql_query, db_config):
                 "count": len(rows) if rows else 0,
                 "columns": columns,
                 "execution_time": execution_time,
+                "parameterized": parameterized is not None,
+                "parameter_count": parameter_count,
+                "profile": query_profile,
                 "message": f"Requête {operation_type} exécutée avec succès"
             }
         
     except pyodbc.Error as e:
         error_msg = str(e)
         logging.error(f"❌ Erreur SQL lors de l'exécution: {error_msg}")
+        discard_connection(conn)
         return f"Erreur SQL: {error_msg}"
     except Exception as e:
         logging.error(f"❌ Erreur générale lors de l'exécution: {e}")
+        discard_connection(conn)
         return f"Erreur: {str(e)}"
 
-def execute_multiple_sql_queries(sql_queries, db_config):
-    """Execute multiple SQL queries and return combined results"""
+def execute_multiple_sql_queries(sql_queries, db_config, profile=False, question=None, deadline=None):
+    """Execute multiple SQL queries and return combined results.
+    deadline (time.time()) bounds the whole batch: each statement gets the remaining time"""
     if not sql_queries:
         return {
             "status": "error",
@@ -272,12 +1242,13 @@ def execute_multiple_sql_queries(sql_queries, db_config):
     
     all_results = []
     total_execution_time = 0
+    budget = new_result_budget()
     
     for i, query in enumerate(sql_queries):
         logging.info(f"🔄 Executing query {i+1}/{len(sql_queries)}: {query[:50]}...")
         
         try:
-            result = execute_sql_query(query, db_config)
+            result = execute_sql_query(query, db_config, profile=profile, budget=budget, deadline=deadline)
             
             # Check if result is an error string
             if isinstance(result, str) and result.startswith("Erreur"):
@@ -298,9 +1269,23 @@ def execute_multiple_sql_queries(sql_queries, db_config):
                     "row_count": result.get("count", 0),
                     "affected_rows": result.get("affected_rows"),
                     "execution_time_ms": result.get("execution_time", 0),
+                    "parameterized": result.get("parameterized", False),
                     "message": result.get("message", "Exécution terminée")
                 }
                 
+                if result.get("spill"):
+                    # Résultat complet sur disque : "results" ne contient que l'aperçu
+                    query_result["spill"] = {
+                        **result["spill"],
+                        "page_url": f"/api/results?id={result['spill']['result_id']}"
+                                    f"&offset={result['spill']['inline_rows']}&limit={RESULT_PAGE_MAX_ROWS}"
+                    }
+                
+                if profile:
+                    query_result["profile"] = result.get("profile")
+                    if query_result["execution_time_ms"] >= SLOW_QUERY_THRESHOLD_MS:
+                        log_slow_query(question, db_config, query_result)
+                
                 total_execution_time += result.get("execution_time", 0)
                 all_results.append(query_result)
                 
@@ -323,14 +1308,28 @@ def execute_multiple_sql_queries(sql_queries, db_config):
         "successful_queries": successful_queries,
         "failed_queries": failed_queries,
         "total_execution_time_ms": round(total_execution_time, 2),
+        "result_memory": {
+            "budget_bytes": budget["limit_bytes"],
+            "peak_bytes": budget["peak_bytes"],
+            "spill_events": budget["spill_events"]
+        },
         "results": all_results
     }
 
-def get_db_schema_from_database(db_config):
-    """Récupère le schéma directement depuis la base de données"""
+def get_db_schema_metadata(db_config, deadline=None):
+    """Récupère la structure (tables, colonnes, clés) et quelques lignes d'exemple.
+    deadline (time.time()) : abandon (connexion, requêtes, entre deux tables) à l'échéance.
+    Retourne une liste de tables, ou un message commençant par "Erreur" """
     try:
-        # Utiliser la connexion robuste
-        conn = connect_to_database(db_config, retries=3)
+        if deadline is None:
+            # Utiliser la connexion robuste
+            conn = connect_to_database(db_config, retries=3)
+        else:
+            login_timeout = seconds_before(deadline, 30)
+            if login_timeout < 1:
+                return "Erreur: Délai écoulé avant la lecture du schéma"
+            conn = connect_to_database(db_config, retries=1, login_timeout=login_timeout)
+            conn.timeout = max(1, seconds_before(deadline, FANOUT_MAX_TIMEOUT))
         cursor = conn.cursor()
 
         # Récupérer toutes les tables
@@ -341,50 +1340,101 @@ def get_db_schema_from_database(db_config):
         """)
         tables = cursor.fetchall()
 
-        schema_info = "=== SCHEMA DE BASE DE DONNÉES ===\n\n"
-        
+        # Clés primaires et étrangères (ignorées si les vues système ne sont pas accessibles)
+        primary_keys = set()
+        foreign_keys = {}
+        try:
+            cursor.execute("""
+                SELECT kcu.TABLE_SCHEMA, kcu.TABLE_NAME, kcu.COLUMN_NAME
+                FROM INFORMATION_SCHEMA.TABLE_CONSTRAINTS tc
+                JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE kcu
+                  ON kcu.CONSTRAINT_NAME = tc.CONSTRAINT_NAME AND kcu.TABLE_SCHEMA = tc.TABLE_SCHEMA
+                WHERE tc.CONSTRAINT_TYPE = 'PRIMARY KEY'
+            """)
+            primary_keys = {tuple(row) for row in cursor.fetchall()}
+            
+            cursor.execute("""
+                SELECT OBJECT_SCHEMA_NAME(fk.parent_object_id), OBJECT_NAME(fk.parent_object_id), pc.name,
+                       OBJECT_SCHEMA_NAME(fk.referenced_object_id), OBJECT_NAME(fk.referenced_object_id), rc.name
+                FROM sys.foreign_key_columns fk
+                JOIN sys.columns pc ON pc.object_id = fk.parent_object_id AND pc.column_id = fk.parent_column_id
+                JOIN sys.columns rc ON rc.object_id = fk.referenced_object_id AND rc.column_id = fk.referenced_column_id
+            """)
+            for schema, table, column, ref_schema, ref_table, ref_column in cursor.fetchall():
+                foreign_keys[(schema, table, column)] = f"{ref_schema}.{ref_table}.{ref_column}"
+        except pyodbc.Error as key_error:
+            logging.warning(f"⚠️ Clés primaires/étrangères non accessibles: {key_error}")
+
+        metadata = []
         for schema, table in tables:
+            if deadline is not None:
+                if time.time() >= deadline:
+                    conn.close()
+                    return "Erreur: Délai écoulé pendant la lecture du schéma"
+                conn.timeout = max(1, seconds_before(deadline, FANOUT_MAX_TIMEOUT))
             # Récupérer les colonnes avec leurs types
             cursor.execute(f"""
-                SELECT COLUMN_NAME, DATA_TYPE, IS_NULLABLE
+                SELECT COLUMN_NAME, DATA_TYPE, IS_NULLABLE, CHARACTER_MAXIMUM_LENGTH
                 FROM INFORMATION_SCHEMA.COLUMNS 
                 WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ?
                 ORDER BY ORDINAL_POSITION
             """, (schema, table))
             
-            columns = cursor.fetchall()
-            
-            schema_info += f"📋 TABLE: {schema}.{table}\n"
-            schema_info += "COLONNES:\n"
-            
-            for col_name, data_type, is_nullable in columns:
-                nullable = "NULL" if is_nullable == "YES" else "NOT NULL"
-                schema_info += f"  • {col_name} ({data_type}, {nullable})\n"
+            table_info = {
+                "schema": schema,
+                "table": table,
+                "columns": [
+                    {
+                        "name": col_name,
+                        "type": data_type,
+                        "nullable": is_nullable == "YES",
+                        "max_length": max_length,
+                        "primary_key": (schema, table, col_name) in primary_keys,
+                        "foreign_key": foreign_keys.get((schema, table, col_name))
+                    }
+                    for col_name, data_type, is_nullable, max_length in cursor.fetchall()
+                ],
+                "example_row": None,
+                "sample_values": {},
+                "sample_error": None
+            }
             
-            # Récupérer un exemple de données
+            # Une ligne d'exemple (sans colonnes volumineuses) et des valeurs pour les
+            # colonnes texte courtes qui peuvent devenir des exemples du schéma compact
+            quote = lambda name: "[" + name.replace("]", "]]") + "]"
+            example_columns = [
+                column["name"] for column in table_info["columns"]
+                if column["max_length"] != -1 and column["type"].lower() not in SCHEMA_EXAMPLE_SKIPPED_TYPES
+            ]
+            sample_columns = [column["name"] for column in table_info["columns"] if is_sample_candidate(column)]
             try:
-                cursor.execute(f"SELECT TOP 1 * FROM [{schema}].[{table}]")
-                sample_row = cursor.fetchone()
-                
-                if sample_row:
-                    schema_info += "EXEMPLE:\n"
-                    column_names = [col[0] for col in columns]
-                    for i, col_name in enumerate(column_names):
-                        value = sample_row[i] if sample_row[i] is not None else "NULL"
-                        if isinstance(value, str) and len(value) > 30:
-                            value = value[:27] + "..."
-                        schema_info += f"  {col_name}: {value}\n"
-                else:
-                    schema_info += "EXEMPLE: (table vide)\n"
-                    
+                if example_columns:
+                    cursor.execute(
+                        f"SELECT TOP 1 {', '.join(map(quote, example_columns))} FROM {quote(schema)}.{quote(table)}"
+                    )
+                    row = cursor.fetchone()
+                    if row is not None:
+                        table_info["example_row"] = {
+                            name: value[:27] + "..." if isinstance(value, str) and len(value) > 30 else value
+                            for name, value in zip(example_columns, row)
+                        }
+                if sample_columns:
+                    cursor.execute(
+                        f"SELECT TOP {SCHEMA_SAMPLE_ROWS} {', '.join(map(quote, sample_columns))} "
+                        f"FROM {quote(schema)}.{quote(table)}"
+                    )
+                    rows = cursor.fetchall()
+                    table_info["sample_values"] = {
+                        name: [row[i] for row in rows] for i, name in enumerate(sample_columns)
+                    }
             except Exception as table_error:
-                schema_info += f"EXEMPLE: (non accessible - {str(table_error)})\n"
+                table_info["sample_error"] = str(table_error)
             
-            schema_info += "\n" + "-"*60 + "\n\n"
+            metadata.append(table_info)
         
         conn.close()
         logging.info("✅ Schéma récupéré avec succès depuis la base")
-        return schema_info
+        return metadata
         
     except pyodbc.Error as e:
         error_msg = str(e)
@@ -407,8 +1457,186 @@ def get_db_schema_from_database(db_config):
         logging.error(f"❌ Erreur générale lors de la récupération du schéma: {e}")
         return f"Erreur: {str(e)}"
 
-def get_db_schema(db_config):
-    """Récupère le schéma avec cache (5 minutes)"""
+def format_schema_readable(metadata):
+    """Schéma lisible (TestConnection) : une ligne par colonne et une ligne d'exemple"""
+    schema_info = "=== SCHEMA DE BASE DE DONNÉES ===\n\n"
+    
+    for table_info in metadata:
+        schema_info += f"📋 TABLE: {table_info['schema']}.{table_info['table']}\n"
+        schema_info += "COLONNES:\n"
+        
+        for column in table_info["columns"]:
+            nullable = "NULL" if column["nullable"] else "NOT NULL"
+            schema_info += f"  • {column['name']} ({column['type']}, {nullable})\n"
+        
+        if table_info["sample_error"] is not None:
+            schema_info += f"EXEMPLE: (non accessible - {table_info['sample_error']})\n"
+        elif table_info["example_row"] is not None:
+            schema_info += "EXEMPLE:\n"
+            for column in table_info["columns"]:
+                if column["name"] not in table_info["example_row"]:
+                    value = "(non lu)"
+                else:
+                    value = table_info["example_row"][column["name"]]
+                    value = value if value is not None else "NULL"
+                schema_info += f"  {column['name']}: {value}\n"
+        else:
+            schema_info += "EXEMPLE: (table vide)\n"
+        
+        schema_info += "\n" + "-"*60 + "\n\n"
+    
+    return schema_info
+
+def count_tokens(text):
+    """Nombre de tokens du texte pour le modèle (tiktoken si disponible, sinon ~4 caractères/token)"""
+    global token_encoder
+    if tiktoken is not None and token_encoder is None:
+        try:
+            token_encoder = tiktoken.encoding_for_model(OPENAI_TOKENIZER_MODEL)
+        except Exception as e:
+            logging.warning(f"⚠️ Tokenizer indisponible, estimation approximative: {e}")
+            token_encoder = False
+    if token_encoder:
+        return len(token_encoder.encode(text))
+    return (len(text) + 3) // 4
+
+def get_tokenizer_name():
+    count_tokens("")
+    return token_encoder.name if token_encoder else "approx-4-chars"
+
+def is_sample_candidate(column):
+    """Colonne texte courte (hors clés) dont les valeurs peuvent servir d'exemples"""
+    return (
+        not column["primary_key"] and not column["foreign_key"]
+        and column["type"].lower() in SCHEMA_TEXT_TYPES
+        and column["max_length"] is not None and 0 < column["max_length"] <= SCHEMA_SAMPLE_COLUMN_MAX_LENGTH
+    )
+
+def get_sample_hint(column, values):
+    """Exemples utiles pour une colonne texte : valeurs répétées (probable liste fermée) ou codes courts.
+    Les valeurs viennent d'un échantillon non ordonné : elles sont présentées comme des exemples.
+    Retourne (priorité, texte) ou None si les exemples n'aident pas le modèle."""
+    if not is_sample_candidate(column):
+        return None
+    
+    values = [value for value in values if isinstance(value, str) and value.strip()]
+    if not values or any(len(value) > SCHEMA_SAMPLE_MAX_LENGTH for value in values):
+        return None
+    
+    distinct = sorted(set(values))
+    quoted = lambda items: ",".join("'" + item.replace("'", "''") + "'" for item in items)
+    
+    # Peu de valeurs distinctes qui se répètent : probablement une liste fermée, mais
+    # l'échantillon peut en omettre
+    if len(distinct) <= SCHEMA_ENUM_MAX_VALUES and len(values) > len(distinct):
+        return 0, f" eg({quoted(distinct)})"
+    # Codes courts sans espace (ex: 'TN', 'EUR', 'A12')
+    if all(len(value) <= 12 and " " not in value for value in distinct):
+        return 1, f" eg({quoted(distinct[:2])})"
+    return None
+
+def build_compact_schema(metadata, token_budget=None):
+    """Schéma compact pour les prompts : table(col type[?] [PK] [FK>ref], ...).
+    La structure est toujours incluse ; les exemples sont ajoutés par priorité
+    (valeurs répétées puis codes courts) tant que le budget de tokens le permet."""
+    token_budget = SCHEMA_PROMPT_TOKEN_BUDGET if token_budget is None else token_budget
+    header = "Tables as schema.table(column type; ?=nullable; PK; FK>schema.table.column; eg(...)=sample values):\n"
+    
+    def render(hints):
+        lines = [header]
+        for t_index, table_info in enumerate(metadata):
+            columns = []
+            for c_index, column in enumerate(table_info["columns"]):
+                definition = f"{column['name']} {column['type']}"
+                if column["nullable"]:
+                    definition += "?"
+                if column["primary_key"]:
+                    definition += " PK"
+                if column["foreign_key"]:
+                    definition += f" FK>{column['foreign_key']}"
+                definition += hints.get((t_index, c_index), "")
+                columns.append(definition)
+            lines.append(f"{table_info['schema']}.{table_info['table']}({', '.join(columns)})\n")
+        return "".join(lines)
+    
+    # Candidats d'exemples, par priorité puis par coût croissant
+    candidates = []
+    for t_index, table_info in enumerate(metadata):
+        for c_index, column in enumerate(table_info["columns"]):
+            hint = get_sample_hint(column, table_info["sample_values"].get(column["name"], []))
+            if hint is not None:
+                priority, text = hint
+                candidates.append((priority, count_tokens(text), (t_index, c_index), text))
+    candidates.sort()
+    
+    hints = {}
+    used_tokens = count_tokens(render(hints))
+    if used_tokens > token_budget:
+        logging.warning(f"⚠️ Structure du schéma ({used_tokens} tokens) au-delà du budget ({token_budget})")
+    for priority, cost, key, text in candidates:
+        if used_tokens + cost <= token_budget:
+            hints[key] = text
+            used_tokens += cost
+    
+    # Le découpage en tokens n'est pas strictement additif : retirer les derniers ajouts si besoin
+    text = render(hints)
+    tokens = count_tokens(text)
+    accepted = [candidate for candidate in candidates if candidate[2] in hints]
+    while tokens > token_budget and accepted:
+        hints.pop(accepted.pop()[2])
+        text = render(hints)
+        tokens = count_tokens(text)
+    
+    return {
+        "text": text,
+        "tokens": tokens,
+        "sample_hints_included": len(hints),
+        "sample_hints_dropped": len(candidates) - len(hints)
+    }
+
+def build_schema_token_report(metadata):
+    """Compare le coût en tokens du schéma lisible et du schéma compact"""
+    readable_tokens = count_tokens(format_schema_readable(metadata))
+    compact = build_compact_schema(metadata)
+    saved = readable_tokens - compact["tokens"]
+    return {
+        "tokenizer": get_tokenizer_name(),
+        "token_budget": SCHEMA_PROMPT_TOKEN_BUDGET,
+        "tables": len(metadata),
+        "columns": sum(len(table_info["columns"]) for table_info in metadata),
+        "readable_tokens": readable_tokens,
+        "compact_tokens": compact["tokens"],
+        "saved_tokens": saved,
+        "saved_pct": round(100 * saved / readable_tokens, 1) if readable_tokens else 0,
+        "sample_hints_included": compact["sample_hints_included"],
+        "sample_hints_dropped": compact["sample_hints_dropped"]
+    }
+
+def get_db_schema_from_database(db_config):
+    """Récupère le schéma lisible directement depuis la base de données"""
+    metadata = get_db_schema_metadata(db_config)
+    if isinstance(metadata, str):
+        return metadata
+    return format_schema_readable(metadata)
+
+def refresh_schema_cache(db_config, deadline=None):
+    """Relit le schéma depuis la base et met à jour le cache (formes lisible et compacte)"""
+    start_time = time.time()
+    metadata = get_db_schema_metadata(db_config, deadline=deadline)
+    if isinstance(metadata, str):
+        return metadata
+    schema_cache["refresh_seconds"] = time.time() - start_time
+    
+    compact = build_compact_schema(metadata)
+    schema_cache["metadata"] = metadata
+    schema_cache["data"] = format_schema_readable(metadata)
+    schema_cache["compact"] = compact["text"]
+    schema_cache["timestamp"] = time.time()
+    logging.info(f"💾 Schéma mis en cache avec succès (forme compacte: {compact['tokens']} tokens)")
+    return None
+
+def get_db_schema(db_config, compact=False):
+    """Récupère le schéma avec cache (5 minutes) ; compact=True pour la forme destinée aux prompts"""
     current_time = time.time()
     
     # Vérifier si le cache est encore valide
@@ -417,51 +1645,482 @@ def get_db_schema(db_config):
         
         cache_age = int(current_time - schema_cache["timestamp"])
         logging.info(f"📋 Utilisation du schéma en cache (âge: {cache_age}s)")
-        return schema_cache["data"]
-    
-    # Le cache est expiré ou vide, récupérer depuis la DB
-    logging.info("🔄 Cache expiré, récupération du schéma depuis la base...")
-    fresh_schema = get_db_schema_from_database(db_config)
-    
-    # Mettre à jour le cache seulement si pas d'erreur
-    if not fresh_schema.startswith("Erreur"):
-        schema_cache["data"] = fresh_schema
-        schema_cache["timestamp"] = current_time
-        logging.info("💾 Schéma mis en cache avec succès")
+    else:
+        # Le cache est expiré ou vide, récupérer depuis la DB
+        logging.info("🔄 Cache expiré, récupération du schéma depuis la base...")
+        error = refresh_schema_cache(db_config)
+        if error:
+            return error
     
-    return fresh_schema
+    return schema_cache["compact"] if compact else schema_cache["data"]
 
-@app.function_name(name="SetDatabaseConfig")
-@app.route(route="set-db-config", auth_level=func.AuthLevel.ANONYMOUS)
-def set_database_config(req: func.HttpRequest) -> func.HttpResponse:
-    """Endpoint pour configurer la base de données dynamiquement"""
-    global current_db_config
+def get_openai_client():
+    """Client Azure OpenAI partagé, avec des connexions HTTP gardées ouvertes entre les requêtes"""
+    global openai_client
+    with openai_client_lock:
+        if openai_client is None:
+            openai_client = AzureOpenAI(
+                api_version="2024-12-01-preview",
+                azure_endpoint="https://selim-mdosvfln-eastus2.openai.azure.com/",
+                api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+                http_client=httpx.Client(
+                    limits=httpx.Limits(keepalive_expiry=OPENAI_KEEPALIVE_SECONDS),
+                    timeout=httpx.Timeout(600.0, connect=5.0)
+                )
+            )
+        return openai_client
+
+def generate_sql_from_question(user_message, schema):
+    """Génère le texte SQL pour une question à partir du schéma via Azure OpenAI"""
+    client = get_openai_client()
+
+    response = client.chat.completions.create(
+        model="gpt-4",
+        messages=[
+            {
+                "role": "system",
+                "content": f"""
+                You are a SQL generator. Rules:
+                1. You can generate multiple SQL queries if the user request requires it
+                2. Separate multiple queries with semicolons (;) or put each query on separate lines
+                3. NEVER add explanations or comments
+                4. Use EXACTLY these tables/columns:
+                
+                {schema}
+                
+                5. Generate valid T-SQL for Azure SQL Database
+                6. Use proper table/column names as shown above
+                7. You can generate SELECT, INSERT, UPDATE, DELETE, CREATE, ALTER, DROP queries
+                8. NEVER use hardcoded table names - always use the actual table names from the schema above
+                
+                Examples:
+                User: show all tables
+                Response: 
+                SELECT * FROM [schema1].[table1];
+                SELECT * FROM [schema1].[table2];
+                SELECT * FROM [schema2].[table3]
+                
+                User: show users and their orders
+                Response:
+                SELECT * FROM [dbo].[users];
+                SELECT * FROM [dbo].[orders]
+                
+                User: add new user named John from USA
+                Response: INSERT INTO [schema].[actual_table_name] (column1, column2) VALUES ('John', 'USA')
+                """
+            },
+            {
+                "role": "user",
+                "content": user_message
+            }
+        ],
+        temperature=0.1,
+        max_tokens=1000
+    )
+
+    return response.choices[0].message.content
+
+def get_schema_fingerprint(db_config, deadline=None):
+    """Calcule une empreinte de la structure (tables, colonnes, types) sans les données"""
+    conn = connect_to_database(
+        db_config, retries=1,
+        login_timeout=max(1, seconds_before(deadline, 30, FANOUT_TIMEOUT_MARGIN_SECONDS))
+    )
+    try:
+        if deadline is not None:
+            conn.timeout = max(1, seconds_before(deadline, FANOUT_MAX_TIMEOUT, FANOUT_TIMEOUT_MARGIN_SECONDS))
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT c.TABLE_SCHEMA, c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE, c.IS_NULLABLE
+            FROM INFORMATION_SCHEMA.COLUMNS c
+            JOIN INFORMATION_SCHEMA.TABLES t
+              ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+            WHERE t.TABLE_TYPE = 'BASE TABLE'
+            ORDER BY c.TABLE_SCHEMA, c.TABLE_NAME, c.ORDINAL_POSITION
+        """)
+        digest = hashlib.sha256()
+        for row in cursor.fetchall():
+            digest.update("|".join(str(value) for value in row).lower().encode("utf-8"))
+            digest.update(b"\n")
+        return digest.hexdigest()
+    finally:
+        conn.close()
+
+def get_registry_schema_entry(name, with_schema=False, deadline=None):
+    """Récupère l'empreinte (et optionnellement le schéma compact) d'une base du registre, avec cache"""
+    current_time = time.time()
+    entry = registry_schema_cache.get(name)
     
-    if req.method == "GET":
-        return func.HttpResponse(
-            "Send a POST request with JSON body: {'server':'...', 'database':'...', 'username':'...', 'password':'...'}",
-            status_code=200
-        )
+    if entry is None or current_time - entry["timestamp"] >= schema_cache["cache_duration"]:
+        entry = {
+            "fingerprint": get_schema_fingerprint(db_registry[name], deadline=deadline),
+            "schema": None,
+            "refresh_seconds": 0,
+            "timestamp": current_time
+        }
+        registry_schema_cache[name] = entry
+    
+    if with_schema and entry["schema"] is None:
+        metadata = get_db_schema_metadata(db_registry[name], deadline=deadline)
+        if isinstance(metadata, str):
+            raise RuntimeError(metadata)
+        entry["schema"] = build_compact_schema(metadata)["text"]
+        entry["refresh_seconds"] = time.time() - current_time
     
+    return entry
+
+def run_on_targets(targets, task, timeouts):
+    """Exécute task(name) en parallèle sur chaque base, avec un timeout propre à chaque cible"""
+    outcomes = {}
+    executor = ThreadPoolExecutor(max_workers=min(len(targets), FANOUT_MAX_WORKERS))
     try:
-        req_body = req.get_json()
+        submitted_at = time.time()
+        futures = {name: executor.submit(task, name) for name in targets}
         
-        # Vérifier que tous les champs requis sont présents
-        required_fields = ['server', 'database', 'username', 'password']
-        for field in required_fields:
-            if field not in req_body or not req_body[field].strip():
-                return func.HttpResponse(
-                    f"Missing or empty required field: {field}",
-                    status_code=400
-                )
+        for name, future in futures.items():
+            remaining = max(0, submitted_at + timeouts[name] - time.time())
+            try:
+                outcomes[name] = ("ok", future.result(timeout=remaining))
+            except FutureTimeoutError:
+                logging.warning(f"⏱️ Timeout sur la base '{name}' après {timeouts[name]}s")
+                outcomes[name] = ("timeout", f"Timeout après {timeouts[name]}s")
+            except Exception as e:
+                logging.error(f"❌ Erreur sur la base '{name}': {e}")
+                outcomes[name] = ("error", str(e))
+    finally:
+        # Ne pas bloquer la réponse sur les cibles encore en cours (timeout)
+        executor.shutdown(wait=False)
+    
+    return outcomes
+
+def find_additive_columns(sql_query):
+    """Alias des agrégats additifs (COUNT/SUM) de la requête, sommables entre bases.
+    Retourne (colonnes, None) ou (None, raison) si on ne peut pas le déterminer sans risque."""
+    if re.search(r'\b(AVG|MIN|MAX|STDEV|STDEVP|VAR|VARP|STRING_AGG)\s*\(', sql_query, re.IGNORECASE):
+        return None, "agrégat non additif (AVG/MIN/MAX...) : précisez 'sum_columns'"
+    
+    aggregates = re.findall(
+        r'\b(?:COUNT_BIG|COUNT|SUM)\s*\((?:[^()]|\([^()]*\))*\)\s*(?:AS\s+)?'
+        r'(\[[^\]]+\]|"[^"]+"|\'[^\']+\'|[A-Za-z_]\w*)?',
+        sql_query, re.IGNORECASE
+    )
+    if not aggregates:
+        return None, "aucun agrégat COUNT/SUM détecté : précisez 'sum_columns'"
+    
+    columns = []
+    for alias in aggregates:
+        if not alias or alias.upper() in ('FROM', 'OVER', 'WHERE', 'GROUP', 'ORDER', 'HAVING'):
+            return None, "agrégat sans alias ou fenêtré : précisez 'sum_columns'"
+        columns.append(alias.strip('[]"\''))
+    return columns, None
+
+def add_result_values(total, value):
+    """Somme deux valeurs d'une colonne agrégée. Les décimaux (DECIMAL, MONEY) arrivent en
+    texte via convert_result_value : ils sont additionnés en Decimal et rendus en texte."""
+    if value is None:
+        return total
+    number = parse_result_number(value)
+    if total is None:
+        return value
+    result = parse_result_number(total) + number
+    if isinstance(total, str) or isinstance(value, str):
+        return str(result)
+    if isinstance(total, float) or isinstance(value, float):
+        return float(result)
+    return result
+
+def parse_result_number(value):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, (float, str)) and not isinstance(value, bool):
+        try:
+            number = Decimal(str(value).strip())
+        except InvalidOperation:
+            number = None
+        if number is not None and number.is_finite():
+            return number
+    raise ValueError(f"valeur non numérique {value!r}")
+
+def merge_fanout_results(target_results, merge_mode, sql_queries, sum_columns=None):
+    """Combine les résultats SELECT de chaque base : 'union' (concaténation) ou 'aggregate'
+    (somme des colonnes sum_columns, ou des alias COUNT/SUM de la requête, groupée sur les autres)"""
+    merged = []
+    query_numbers = sorted({
+        query["query_number"]
+        for target in target_results if target["status"] in ("success", "partial")
+        for query in target["results"]
+    })
+    
+    for query_number in query_numbers:
+        sources = []
+        truncated_databases = []  # Résultats déversés sur disque : seules les lignes en ligne sont fusionnées
+        for target in target_results:
+            if target["status"] not in ("success", "partial"):
+                continue
+            for query in target["results"]:
+                if (query["query_number"] == query_number and query["status"] == "success"
+                        and query.get("operation") == "SELECT"):
+                    sources.append((target["database"], query["results"]))
+                    if query.get("spill"):
+                        truncated_databases.append(target["database"])
+        
+        if not sources:
+            continue
+        
+        column_sets = {tuple(rows[0].keys()) for _, rows in sources if rows}
+        if len(column_sets) > 1:
+            merged.append({
+                "query_number": query_number,
+                "status": "error",
+                "message": "Colonnes différentes selon les bases, fusion impossible"
+            })
+            continue
+        
+        if merge_mode == "union":
+            rows = [
+                {"_database": database, **row}
+                for database, database_rows in sources
+                for row in database_rows
+            ]
+        elif truncated_databases:
+            merged.append({
+                "query_number": query_number,
+                "status": "error",
+                "message": "Agrégation impossible - résultats incomplets (sur disque) pour: "
+                           f"{', '.join(truncated_databases)}",
+                "truncated": True,
+                "truncated_databases": truncated_databases
+            })
+            continue
+        else:
+            all_rows = [row for _, database_rows in sources for row in database_rows]
+            columns = list(all_rows[0].keys()) if all_rows else []
+            if sum_columns:
+                additive_columns, reason = sum_columns, None
+            else:
+                additive_columns, reason = find_additive_columns(sql_queries[query_number - 1])
+            if reason is None and all_rows:
+                unknown = [column for column in additive_columns if column not in columns]
+                if unknown:
+                    reason = f"colonnes à sommer absentes du résultat: {', '.join(unknown)}"
+            if reason is not None:
+                merged.append({
+                    "query_number": query_number,
+                    "status": "error",
+                    "message": f"Agrégation impossible - {reason}"
+                })
+                continue
+            
+            # Regroupe sur toutes les colonnes qui ne sont pas à sommer
+            groups = {}
+            try:
+                for row in all_rows:
+                    key = tuple(row[column] for column in columns if column not in additive_columns)
+                    if key not in groups:
+                        groups[key] = {**row, **{column: None for column in additive_columns}}
+                    for column in additive_columns:
+                        groups[key][column] = add_result_values(groups[key][column], row[column])
+            except ValueError as e:
+                merged.append({
+                    "query_number": query_number,
+                    "status": "error",
+                    "message": f"Agrégation impossible - {e}"
+                })
+                continue
+            rows = list(groups.values())
+        
+        merged.append({
+            "query_number": query_number,
+            "status": "success",
+            "merge": merge_mode,
+            "source_databases": [database for database, _ in sources],
+            "truncated": bool(truncated_databases),
+            "truncated_databases": truncated_databases,
+            "results": rows,
+            "row_count": len(rows)
+        })
+    
+    return merged
+
+def track_live_traffic(handler):
+    """Compte les requêtes en cours pour que le préchauffage ne concurrence pas le trafic"""
+    @functools.wraps(handler)
+    def wrapper(req):
+        with live_traffic_lock:
+            live_traffic["in_flight"] += 1
+            live_traffic["last_request"] = time.time()
+        try:
+            return handler(req)
+        finally:
+            with live_traffic_lock:
+                live_traffic["in_flight"] -= 1
+    return wrapper
+
+def get_prewarm_settings(db_config):
+    return {**PREWARM_DEFAULTS, **db_config.get('prewarm', {})}
+
+def prewarm_connections(db_config, min_connections, deadline):
+    """Garde au moins min_connections connexions vérifiées dans le pool"""
+    connections = []
+    try:
+        # Au-delà de POOL_MAX_IDLE, release_connection fermerait les connexions ouvertes
+        while len(connections) < min(min_connections, POOL_MAX_IDLE):
+            connect_timeout = seconds_before(deadline, 30)
+            if connect_timeout < 1:
+                break
+            connections.append(acquire_connection(db_config, connect_timeout=connect_timeout))
+    finally:
+        for conn in connections:
+            release_connection(db_config, conn)
+    return len(connections)
+
+def prewarm_schema(name, db_config, deadline):
+    """Rafraîchit le schéma en cache avant l'expiration de son TTL, si la dernière
+    lecture mesurée tient dans le temps restant"""
+    refresh_age = schema_cache["cache_duration"] - PREWARM_SCHEMA_MARGIN_SECONDS
+    current_time = time.time()
+    
+    if name is None:
+        if schema_cache["data"] is not None and current_time - schema_cache["timestamp"] < refresh_age:
+            return False
+        if current_time + schema_cache["refresh_seconds"] > deadline:
+            return False
+        error = refresh_schema_cache(db_config, deadline=deadline)
+        if error:
+            raise RuntimeError(error)
+        return True
+    
+    entry = registry_schema_cache.get(name)
+    if entry is not None and current_time - entry["timestamp"] < refresh_age:
+        return False
+    if entry is not None and current_time + entry["refresh_seconds"] > deadline:
+        return False
+    with_schema = entry is not None and entry["schema"] is not None
+    registry_schema_cache.pop(name, None)
+    get_registry_schema_entry(name, with_schema=with_schema, deadline=deadline)
+    return True
+
+def prewarm_hot_queries(db_config, limit, deadline):
+    """Rejoue les SELECT les plus fréquents (cache de plans et pages en mémoire côté serveur)"""
+    with hot_queries_lock:
+        queries = sorted(
+            hot_queries.get(get_pool_key(db_config), {}).values(),
+            key=lambda entry: entry["count"],
+            reverse=True
+        )[:limit]
+        queries = [dict(entry) for entry in queries]
+    
+    replayed = 0
+    for entry in queries:
+        if seconds_before(deadline, 30) < 1 or not is_quiet_period():
+            break
+        conn = acquire_connection(db_config, connect_timeout=seconds_before(deadline, 30))
+        try:
+            conn.timeout = max(1, seconds_before(deadline, FANOUT_MAX_TIMEOUT))
+            cursor = conn.cursor()
+            if entry["params"] is not None:
+                cursor.setinputsizes(entry["input_sizes"])
+                cursor.execute(entry["sql"], entry["params"])
+            else:
+                cursor.execute(entry["sql"])
+            while cursor.fetchmany(1000):
+                if time.time() >= deadline:
+                    cursor.cancel()
+                    break
+            conn.rollback()
+            conn.timeout = 0
+            release_connection(db_config, conn)
+            replayed += 1
+        except pyodbc.Error as e:
+            logging.warning(f"⚠️ Préchauffage: requête fréquente en échec: {e}")
+            discard_connection(conn)
+    return replayed
+
+def is_quiet_period():
+    with live_traffic_lock:
+        return (live_traffic["in_flight"] == 0
+                and time.time() - live_traffic["last_request"] >= PREWARM_QUIET_SECONDS)
+
+def has_live_traffic():
+    with live_traffic_lock:
+        return live_traffic["in_flight"] > 0
+
+def run_prewarm():
+    """Préchauffe connexions, schémas, client OpenAI et requêtes fréquentes dans le budget"""
+    start_time = time.time()
+    deadline = start_time + PREWARM_BUDGET_MS / 1000
+    report = {"databases": [], "openai": None, "skipped": None}
+    
+    targets = []
+    if current_db_config is not None:
+        targets.append((None, current_db_config))
+    targets.extend(db_registry.items())
+    
+    # Fermer les connexions inactives des bases qui ne sont plus configurées
+    active_keys = {get_pool_key(db_config) for _, db_config in targets}
+    with connection_pool_lock:
+        stale = [key for key in connection_pools if key not in active_keys]
+        stale_connections = [conn for key in stale for conn, _ in connection_pools.pop(key)]
+    for conn in stale_connections:
+        close_quietly(conn)
+    
+    if has_live_traffic():
+        report["skipped"] = "live traffic"
+        return report
+    
+    for name, db_config in targets:
+        settings = get_prewarm_settings(db_config)
+        if not settings["enabled"]:
+            continue
+        if time.time() >= deadline or has_live_traffic():
+            report["skipped"] = "budget exhausted" if time.time() >= deadline else "live traffic"
+            break
+        
+        result = {"database": name or "current"}
+        try:
+            result["connections"] = prewarm_connections(db_config, settings["min_connections"], deadline)
+            if settings["refresh_schema"] and time.time() < deadline:
+                result["schema_refreshed"] = prewarm_schema(name, db_config, deadline)
+            if settings["hot_queries"] > 0:
+                result["hot_queries_replayed"] = prewarm_hot_queries(db_config, settings["hot_queries"], deadline)
+        except Exception as e:
+            logging.warning(f"⚠️ Préchauffage de '{result['database']}' incomplet: {e}")
+            result["error"] = str(e)
+        report["databases"].append(result)
+    
+    if PREWARM_OPENAI and time.time() < deadline and not has_live_traffic():
+        try:
+            get_openai_client().models.list()
+            report["openai"] = "ok"
+        except Exception as e:
+            logging.warning(f"⚠️ Préchauffage OpenAI en échec: {e}")
+            report["openai"] = f"error: {str(e)}"
+    
+    report["elapsed_ms"] = round((time.time() - start_time) * 1000, 2)
+    return report
+
+@app.function_name(name="SetDatabaseConfig")
+@app.route(route="set-db-config", auth_level=func.AuthLevel.ANONYMOUS)
+def set_database_config(req: func.HttpRequest) -> func.HttpResponse:
+    """Endpoint pour configurer la base de données dynamiquement"""
+    global current_db_config
+    
+    if req.method == "GET":
+        return func.HttpResponse(
+            "Send a POST request with JSON body: {'server':'...', 'database':'...', 'username':'...', 'password':'...'}",
+            status_code=200
+        )
+    
+    try:
+        req_body = req.get_json()
+        
+        # Vérifier que tous les champs requis sont présents
+        db_config, error = parse_db_config(req_body)
+        if error:
+            return func.HttpResponse(error, status_code=400)
         
         # Configurer la base de données
-        current_db_config = {
-            'server': req_body['server'].strip(),
-            'database': req_body['database'].strip(), 
-            'username': req_body['username'].strip(),
-            'password': req_body['password'].strip()
-        }
+        current_db_config = db_config
         
         # Tester la connexion
         try:
@@ -508,6 +2167,7 @@ def set_database_config(req: func.HttpRequest) -> func.HttpResponse:
 
 @app.function_name(name="SqlAssistant")
 @app.route(route="chat", auth_level=func.AuthLevel.ANONYMOUS)
+@track_live_traffic
 def main(req: func.HttpRequest) -> func.HttpResponse:
     global current_db_config
     logging.info('SQL Assistant processing request')
@@ -534,6 +2194,16 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
         req_body = req.get_json()
         user_message = req_body.get('message', '').strip()
+        profile = req_body.get('profile', SQL_PROFILING)
+        if not isinstance(profile, bool):
+            return func.HttpResponse(
+                json.dumps({
+                    "status": "error",
+                    "message": "Invalid field: profile (must be true or false)"
+                }),
+                status_code=400,
+                mimetype="application/json"
+            )
         if not user_message:
             return func.HttpResponse(
                 json.dumps({
@@ -563,8 +2233,8 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json"
         )
 
-    # Récupérer le schéma avec cache
-    schema = get_db_schema(current_db_config)
+    # Récupérer le schéma compact (prompt) avec cache
+    schema = get_db_schema(current_db_config, compact=True)
     
     if schema.startswith("Erreur"):
         return func.HttpResponse(
@@ -578,58 +2248,7 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
 
     # Generate SQL using OpenAI
     try:
-        client = AzureOpenAI(
-            api_version="2024-12-01-preview",
-            azure_endpoint="https://selim-mdosvfln-eastus2.openai.azure.com/",
-            api_key=os.getenv("AZURE_OPENAI_API_KEY")
-        )
-
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"""
-                    You are a SQL generator. Rules:
-                    1. You can generate multiple SQL queries if the user request requires it
-                    2. Separate multiple queries with semicolons (;) or put each query on separate lines
-                    3. NEVER add explanations or comments
-                    4. Use EXACTLY these tables/columns:
-                    
-                    {schema}
-                    
-                    5. Generate valid T-SQL for Azure SQL Database
-                    6. Use proper table/column names as shown above
-                    7. You can generate SELECT, INSERT, UPDATE, DELETE, CREATE, ALTER, DROP queries
-                    8. NEVER use hardcoded table names - always use the actual table names from the schema above
-                    
-                    Examples:
-                    User: show all tables
-                    Response: 
-                    SELECT * FROM [schema1].[table1];
-                    SELECT * FROM [schema1].[table2];
-                    SELECT * FROM [schema2].[table3]
-                    
-                    User: show users and their orders
-                    Response:
-                    SELECT * FROM [dbo].[users];
-                    SELECT * FROM [dbo].[orders]
-                    
-                    User: add new user named John from USA
-                    Response: INSERT INTO [schema].[actual_table_name] (column1, column2) VALUES ('John', 'USA')
-                    """
-                },
-                {
-                    "role": "user",
-                    "content": user_message
-                }
-            ],
-            temperature=0.1,
-            max_tokens=1000
-        )
-
-        # Get the SQL response
-        sql_text = response.choices[0].message.content
+        sql_text = generate_sql_from_question(user_message, schema)
         logging.info(f"✅ SQL généré: {sql_text}")
         
         # Parse multiple queries
@@ -647,7 +2266,9 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
         
         # Execute all queries
         try:
-            execution_results = execute_multiple_sql_queries(sql_queries, current_db_config)
+            execution_results = execute_multiple_sql_queries(
+                sql_queries, current_db_config, profile=profile, question=user_message
+            )
             
             return func.HttpResponse(
                 json.dumps(execution_results, indent=2, default=str),
@@ -677,9 +2298,465 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json"
         )
 
+@app.function_name(name="DatabaseRegistry")
+@app.route(route="db-registry", auth_level=func.AuthLevel.ANONYMOUS)
+def database_registry(req: func.HttpRequest) -> func.HttpResponse:
+    """Endpoint pour gérer le registre nommé des bases (GET liste, POST ajout, DELETE retrait)"""
+    if req.method == "GET":
+        return func.HttpResponse(
+            json.dumps({
+                "status": "success",
+                "databases": [
+                    {"name": name, "server": config['server'], "database": config['database']}
+                    for name, config in db_registry.items()
+                ]
+            }),
+            status_code=200,
+            mimetype="application/json"
+        )
+    
+    if req.method == "DELETE":
+        name = req.params.get('name', '').strip()
+        if name not in db_registry:
+            return func.HttpResponse(
+                json.dumps({"status": "error", "message": f"Base inconnue: {name}"}),
+                status_code=404,
+                mimetype="application/json"
+            )
+        del db_registry[name]
+        registry_schema_cache.pop(name, None)
+        return func.HttpResponse(
+            json.dumps({"status": "success", "message": f"Base '{name}' retirée du registre"}),
+            status_code=200,
+            mimetype="application/json"
+        )
+    
+    try:
+        req_body = req.get_json()
+        
+        name = str(req_body.get('name', '')).strip()
+        if not name:
+            return func.HttpResponse(
+                "Missing or empty required field: name",
+                status_code=400
+            )
+        
+        db_config, error = parse_db_config(req_body)
+        if error:
+            return func.HttpResponse(error, status_code=400)
+        
+        if req_body.get('timeout') is not None:
+            db_config['timeout'] = parse_timeout(req_body['timeout'])
+            if db_config['timeout'] is None:
+                return func.HttpResponse(
+                    f"Invalid 'timeout': must be a number of seconds in ]0, {FANOUT_MAX_TIMEOUT}]",
+                    status_code=400
+                )
+        
+        # Tester la connexion avant d'enregistrer
+        try:
+            conn = connect_to_database(db_config, retries=1)
+            conn.close()
+        except Exception as e:
+            return func.HttpResponse(
+                json.dumps({
+                    "status": "error",
+                    "message": f"Impossible de se connecter à la base de données: {str(e)}"
+                }),
+                status_code=400,
+                mimetype="application/json"
+            )
+        
+        db_registry[name] = db_config
+        registry_schema_cache.pop(name, None)
+        
+        return func.HttpResponse(
+            json.dumps({
+                "status": "success",
+                "message": f"Base '{name}' enregistrée",
+                "name": name,
+                "server": db_config['server'],
+                "database": db_config['database']
+            }),
+            status_code=200,
+            mimetype="application/json"
+        )
+    
+    except ValueError:
+        return func.HttpResponse(
+            "Invalid JSON format",
+            status_code=400
+        )
+    except Exception as e:
+        logging.error(f"Registry error: {str(e)}")
+        return func.HttpResponse(
+            f"Registry error: {str(e)}",
+            status_code=500
+        )
+
+@app.function_name(name="SqlAssistantMulti")
+@app.route(route="chat-multi", auth_level=func.AuthLevel.ANONYMOUS)
+@track_live_traffic
+def chat_multi(req: func.HttpRequest) -> func.HttpResponse:
+    """Génère le SQL une seule fois et l'exécute en parallèle sur plusieurs bases du registre"""
+    logging.info('SQL Assistant processing fan-out request')
+
+    if req.method == "GET":
+        return func.HttpResponse(
+            "Send a POST request with JSON body: {'message':'your query', 'databases':['name1','name2'], 'timeout':30, 'merge':'union'|'aggregate', 'sum_columns':['n']}",
+            status_code=200
+        )
+
+    try:
+        req_body = req.get_json()
+        if not isinstance(req_body, dict):
+            raise ValueError("JSON body must be an object")
+        user_message = req_body.get('message', '')
+        targets = req_body.get('databases') or list(db_registry.keys())
+        request_timeout = req_body.get('timeout')
+        merge_mode = req_body.get('merge')
+        sum_columns = req_body.get('sum_columns')
+    except ValueError:
+        return func.HttpResponse(
+            json.dumps({
+                "status": "error",
+                "message": "Invalid JSON format. Send: {'message':'your query', 'databases':[...]}"
+            }),
+            status_code=400,
+            mimetype="application/json"
+        )
+
+    if not isinstance(user_message, str) or not user_message.strip():
+        return func.HttpResponse(
+            json.dumps({"status": "error", "message": "Missing or empty 'message' field"}),
+            status_code=400,
+            mimetype="application/json"
+        )
+    user_message = user_message.strip()
+    
+    if not isinstance(targets, list) or not all(isinstance(name, str) for name in targets):
+        return func.HttpResponse(
+            json.dumps({"status": "error", "message": "'databases' must be a list of registered names"}),
+            status_code=400,
+            mimetype="application/json"
+        )
+    
+    if not targets:
+        return func.HttpResponse(
+            json.dumps({"status": "error", "message": "No database registered. Use /db-registry first."}),
+            status_code=400,
+            mimetype="application/json"
+        )
+    
+    unknown = [name for name in targets if name not in db_registry]
+    if unknown:
+        return func.HttpResponse(
+            json.dumps({"status": "error", "message": f"Unknown databases: {', '.join(unknown)}"}),
+            status_code=400,
+            mimetype="application/json"
+        )
+    
+    if merge_mode not in (None, "union", "aggregate"):
+        return func.HttpResponse(
+            json.dumps({"status": "error", "message": "'merge' must be 'union' or 'aggregate'"}),
+            status_code=400,
+            mimetype="application/json"
+        )
+    
+    if sum_columns is not None and (
+            not isinstance(sum_columns, list) or not all(isinstance(c, str) for c in sum_columns)):
+        return func.HttpResponse(
+            json.dumps({"status": "error", "message": "'sum_columns' must be a list of column names"}),
+            status_code=400,
+            mimetype="application/json"
+        )
+    
+    if request_timeout is not None:
+        request_timeout = parse_timeout(request_timeout)
+        if request_timeout is None:
+            return func.HttpResponse(
+                json.dumps({
+                    "status": "error",
+                    "message": f"'timeout' must be a number of seconds in ]0, {FANOUT_MAX_TIMEOUT}]"
+                }),
+                status_code=400,
+                mimetype="application/json"
+            )
+    
+    # Timeout par cible : valeur du registre, sinon celle de la requête, sinon défaut
+    timeouts = {
+        name: db_registry[name].get('timeout') or request_timeout or FANOUT_DEFAULT_TIMEOUT
+        for name in targets
+    }
+
+    # 1. Empreinte du schéma de chaque cible (en parallèle)
+    # Échéances fixées avant la soumission : le client abandonne toujours après le serveur
+    deadlines = {name: time.time() + timeouts[name] for name in targets}
+    fingerprints = run_on_targets(
+        targets, lambda name: get_registry_schema_entry(name, deadline=deadlines[name])["fingerprint"], timeouts
+    )
+    target_results = {}
+    for name, (state, value) in fingerprints.items():
+        if state != "ok":
+            target_results[name] = {"database": name, "status": state, "message": value}
+    
+    # Le schéma de référence est l'empreinte majoritaire (à égalité, la première cible)
+    counts = {}
+    for name in targets:
+        state, value = fingerprints[name]
+        if state == "ok":
+            counts[value] = counts.get(value, 0) + 1
+    
+    if not counts:
+        return func.HttpResponse(
+            json.dumps({
+                "status": "error",
+                "message": "Aucune base cible joignable",
+                "targets": [target_results[name] for name in targets]
+            }, indent=2),
+            status_code=500,
+            mimetype="application/json"
+        )
+    
+    reference_fingerprint = max(counts, key=counts.get)
+    compatible = []
+    for name in targets:
+        state, value = fingerprints[name]
+        if state != "ok":
+            continue
+        if value == reference_fingerprint:
+            compatible.append(name)
+        else:
+            target_results[name] = {
+                "database": name,
+                "status": "schema_mismatch",
+                "message": "Schéma différent de l'empreinte de référence, requête non exécutée"
+            }
+
+    # 2. Génération du SQL une seule fois sur le schéma partagé
+    try:
+        schema = get_registry_schema_entry(compatible[0], with_schema=True)["schema"]
+        sql_text = generate_sql_from_question(user_message, schema)
+        logging.info(f"✅ SQL généré (fan-out): {sql_text}")
+    except Exception as e:
+        logging.error(f"OpenAI error: {str(e)}")
+        return func.HttpResponse(
+            json.dumps({
+                "status": "error",
+                "message": f"AI Service Error: {str(e)}"
+            }),
+            status_code=500,
+            mimetype="application/json"
+        )
+    
+    sql_queries = parse_multiple_sql_queries(sql_text)
+    if not sql_queries:
+        return func.HttpResponse(
+            json.dumps({
+                "status": "error",
+                "message": "No valid SQL queries could be parsed from the AI response"
+            }),
+            status_code=400,
+            mimetype="application/json"
+        )
+
+    # 3. Exécution concurrente sur les bases compatibles
+    deadlines = {name: time.time() + timeouts[name] for name in compatible}
+    executions = run_on_targets(
+        compatible,
+        lambda name: execute_multiple_sql_queries(sql_queries, db_registry[name], deadline=deadlines[name]),
+        timeouts
+    )
+    read_only = all(query.lstrip().split(None, 1)[0].upper() == 'SELECT' for query in sql_queries)
+    for name, (state, value) in executions.items():
+        if state == "ok":
+            target_results[name] = {"database": name, **value}
+        elif state == "timeout" and not read_only:
+            # Une modification encore en cours côté serveur a pu être validée
+            target_results[name] = {
+                "database": name,
+                "status": "unknown",
+                "message": f"{value} - la modification a pu être validée sur cette base"
+            }
+        else:
+            target_results[name] = {"database": name, "status": state, "message": value}
+    
+    ordered_results = [target_results[name] for name in targets]
+    succeeded = sum(1 for target in ordered_results if target["status"] == "success")
+    
+    response = {
+        "status": "success" if succeeded == len(targets) else ("error" if succeeded == 0 else "partial"),
+        "schema_fingerprint": reference_fingerprint,
+        "sql_queries": sql_queries,
+        "total_targets": len(targets),
+        "successful_targets": succeeded,
+        "failed_targets": len(targets) - succeeded,
+        "targets": ordered_results
+    }
+    
+    if merge_mode:
+        response["merged"] = merge_fanout_results(ordered_results, merge_mode, sql_queries, sum_columns)
+    
+    return func.HttpResponse(
+        json.dumps(response, indent=2, default=str),
+        status_code=200,
+        mimetype="application/json"
+    )
+
+@app.function_name(name="PlanStats")
+@app.route(route="plan-stats", auth_level=func.AuthLevel.ANONYMOUS)
+def plan_stats(req: func.HttpRequest) -> func.HttpResponse:
+    """Statistiques de paramétrage et de réutilisation des plans d'exécution"""
+    stats = {
+        "status": "success",
+        "local": get_plan_reuse_stats()
+    }
+    
+    if current_db_config is not None:
+        try:
+            stats["server"] = get_server_plan_cache_stats(current_db_config)
+        except Exception as e:
+            logging.warning(f"⚠️ Cache de plans serveur non accessible: {e}")
+            stats["server"] = {"error": f"Non accessible (VIEW DATABASE STATE requis): {str(e)}"}
+    
+    return func.HttpResponse(
+        json.dumps(stats, indent=2, default=str),
+        status_code=200,
+        mimetype="application/json"
+    )
+
+@app.function_name(name="SchemaReport")
+@app.route(route="schema-report", auth_level=func.AuthLevel.ANONYMOUS)
+def schema_report(req: func.HttpRequest) -> func.HttpResponse:
+    """Tokens de prompt économisés par le schéma compact (base courante ou ?name= du registre)"""
+    name = req.params.get('name', '').strip()
+    if name:
+        if name not in db_registry:
+            return func.HttpResponse(
+                json.dumps({"status": "error", "message": f"Base inconnue: {name}"}),
+                status_code=404,
+                mimetype="application/json"
+            )
+        metadata = get_db_schema_metadata(db_registry[name])
+    elif current_db_config is None:
+        return func.HttpResponse(
+            json.dumps({"status": "error", "message": "No database configuration set"}),
+            status_code=400,
+            mimetype="application/json"
+        )
+    else:
+        schema = get_db_schema(current_db_config)
+        metadata = schema if schema.startswith("Erreur") else schema_cache["metadata"]
+    
+    if isinstance(metadata, str):
+        return func.HttpResponse(
+            json.dumps({"status": "error", "message": metadata}),
+            status_code=500,
+            mimetype="application/json"
+        )
+    
+    report = build_schema_token_report(metadata)
+    if req.params.get('include_text', '').lower() in ('1', 'true', 'yes'):
+        report["compact_schema"] = build_compact_schema(metadata)["text"]
+    
+    return func.HttpResponse(
+        json.dumps({"status": "success", **report}, indent=2),
+        status_code=200,
+        mimetype="application/json"
+    )
+
+@app.function_name(name="Results")
+@app.route(route="results", auth_level=func.AuthLevel.ANONYMOUS)
+def results_endpoint(req: func.HttpRequest) -> func.HttpResponse:
+    """Pagination/export des résultats basculés sur disque ; sans id, métriques de bascule"""
+    result_id = req.params.get('id', '').strip()
+    
+    if not result_id:
+        purge_expired_spills()
+        with spilled_results_lock:
+            stats = {
+                "status": "success",
+                "memory_budget_bytes": RESULT_MEMORY_BUDGET_BYTES,
+                **result_memory_stats,
+                "active_spills": len(spilled_results),
+                "active_spill_bytes": sum(spill.size_bytes for spill in spilled_results.values())
+            }
+        return func.HttpResponse(
+            json.dumps(stats, indent=2),
+            status_code=200,
+            mimetype="application/json"
+        )
+    
+    spill = get_spilled_result(result_id)
+    if spill is None:
+        return func.HttpResponse(
+            json.dumps({
+                "status": "error",
+                "message": "Résultat inconnu ou expiré (les résultats sur disque sont propres à chaque instance)"
+            }),
+            status_code=404,
+            mimetype="application/json"
+        )
+    
+    if req.params.get('format', '').lower() == 'jsonl':
+        if spill.size_bytes > RESULT_EXPORT_MAX_BYTES:
+            return func.HttpResponse(
+                json.dumps({
+                    "status": "error",
+                    "message": f"Export trop volumineux ({spill.size_bytes} octets), utilisez la pagination"
+                }),
+                status_code=413,
+                mimetype="application/json"
+            )
+        return func.HttpResponse(
+            spill.read_jsonl(),
+            status_code=200,
+            mimetype="application/x-ndjson"
+        )
+    
+    try:
+        offset = max(0, int(req.params.get('offset', 0)))
+        limit = min(RESULT_PAGE_MAX_ROWS, max(1, int(req.params.get('limit', RESULT_PAGE_MAX_ROWS))))
+    except ValueError:
+        return func.HttpResponse(
+            json.dumps({"status": "error", "message": "'offset' and 'limit' must be integers"}),
+            status_code=400,
+            mimetype="application/json"
+        )
+    
+    # Les lignes sont recopiées telles quelles depuis le disque (tableaux de valeurs)
+    header = json.dumps({
+        "status": "success",
+        "result_id": spill.result_id,
+        "columns": spill.columns,
+        "total_rows": spill.row_count,
+        "truncated": spill.truncated,
+        "offset": offset,
+        "limit": limit
+    })
+    body = header[:-1].encode("utf-8") + b', "rows": ' + spill.read_rows_json(offset, limit) + b"}"
+    
+    return func.HttpResponse(
+        body,
+        status_code=200,
+        mimetype="application/json"
+    )
+
+@app.function_name(name="Prewarm")
+@app.timer_trigger(schedule=PREWARM_SCHEDULE, arg_name="timer", run_on_startup=False, use_monitor=False)
+def prewarm(timer: func.TimerRequest) -> None:
+    """Préchauffage périodique pour que le premier utilisateur après une période d'inactivité
+    ne paie pas la connexion, la lecture du schéma et la connexion OpenAI"""
+    if timer.past_due:
+        logging.info("⏰ Préchauffage en retard sur son planning")
+    
+    report = run_prewarm()
+    logging.info(f"🔥 Préchauffage terminé: {json.dumps(report, default=str)}")
+
 # Keep existing endpoints...
 @app.function_name(name="TestConnection")
 @app.route(route="test-db", auth_level=func.AuthLevel.ANONYMOUS)
+@track_live_traffic
 def test_db(req: func.HttpRequest) -> func.HttpResponse:
     global current_db_config
     
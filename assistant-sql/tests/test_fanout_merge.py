@@ -0,0 +1,104 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("azure.functions")
+pytest.importorskip("openai")
+pytest.importorskip("pyodbc")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from function_app import find_additive_columns, merge_fanout_results  # noqa: E402
+
+
+def target(database, rows, spill=None):
+    return {
+        "database": database,
+        "status": "success",
+        "results": [{
+            "query_number": 1,
+            "status": "success",
+            "operation": "SELECT",
+            "results": rows,
+            "spill": spill,
+        }],
+    }
+
+
+@pytest.mark.parametrize("sql_query, columns", [
+    ("SELECT COUNT(*) AS n FROM t", ["n"]),
+    ("SELECT YEAR(d) AS annee, COUNT(*) AS n FROM t GROUP BY YEAR(d)", ["n"]),
+    ("SELECT SUM(ISNULL(m, 0)) [total], COUNT(DISTINCT x) c FROM t", ["total", "c"]),
+    ("SELECT pays, COUNT_BIG(*) AS 'nb' FROM t GROUP BY pays", ["nb"]),
+])
+def test_find_additive_columns(sql_query, columns):
+    assert find_additive_columns(sql_query) == (columns, None)
+
+
+@pytest.mark.parametrize("sql_query", [
+    "SELECT COUNT(*) FROM t",
+    "SELECT AVG(montant) AS moyenne FROM t",
+    "SELECT MAX(d) AS derniere, COUNT(*) AS n FROM t",
+    "SELECT SUM(m) OVER (PARTITION BY a) FROM t",
+    "SELECT pays FROM t",
+])
+def test_find_additive_columns_undetermined(sql_query):
+    columns, reason = find_additive_columns(sql_query)
+    assert columns is None
+    assert reason
+
+
+def test_merge_aggregate_groups_on_other_columns():
+    merged = merge_fanout_results([
+        target("a", [{"annee": 2023, "n": 5}, {"annee": 2024, "n": 3}]),
+        target("b", [{"annee": 2023, "n": 1}]),
+    ], "aggregate", ["SELECT YEAR(d) AS annee, COUNT(*) AS n FROM t GROUP BY YEAR(d)"])
+    assert merged[0]["status"] == "success"
+    assert merged[0]["results"] == [{"annee": 2023, "n": 6}, {"annee": 2024, "n": 3}]
+
+
+def test_merge_aggregate_sums_decimal_text():
+    merged = merge_fanout_results([
+        target("a", [{"pays": "FR", "total": "10.50"}]),
+        target("b", [{"pays": "FR", "total": "2.25"}]),
+        target("c", [{"pays": "FR", "total": None}]),
+    ], "aggregate", ["SELECT pays, SUM(montant) AS total FROM t GROUP BY pays"])
+    assert merged[0]["results"] == [{"pays": "FR", "total": "12.75"}]
+
+
+def test_merge_aggregate_null_first():
+    merged = merge_fanout_results([
+        target("a", [{"total": None}]),
+        target("b", [{"total": "2.25"}]),
+    ], "aggregate", ["SELECT SUM(montant) AS total FROM t"])
+    assert merged[0]["results"] == [{"total": "2.25"}]
+
+
+def test_merge_aggregate_sum_columns():
+    merged = merge_fanout_results([
+        target("a", [{"pays": "FR", "moyenne": 4.5, "n": 2}]),
+        target("b", [{"pays": "FR", "moyenne": 4.5, "n": 1.5}]),
+    ], "aggregate", ["SELECT pays, AVG(x) AS moyenne, COUNT(*) AS n FROM t GROUP BY pays"], ["n"])
+    assert merged[0]["results"] == [{"pays": "FR", "moyenne": 4.5, "n": 3.5}]
+
+
+@pytest.mark.parametrize("sql_query, sum_columns, rows", [
+    ("SELECT AVG(x) AS moyenne FROM t", None, [{"moyenne": 1}]),
+    ("SELECT COUNT(*) AS n FROM t", ["absente"], [{"n": 1}]),
+    ("SELECT pays AS n FROM t", ["n"], [{"n": "FR"}]),
+])
+def test_merge_aggregate_errors(sql_query, sum_columns, rows):
+    merged = merge_fanout_results([target("a", rows), target("b", rows)], "aggregate", [sql_query], sum_columns)
+    assert merged[0]["status"] == "error"
+
+
+def test_merge_with_spilled_target():
+    targets = [target("a", [{"n": 1}], spill={"result_id": "x"}), target("b", [{"n": 2}])]
+    union = merge_fanout_results(targets, "union", ["SELECT n FROM t"])
+    assert union[0]["truncated"] is True
+    assert union[0]["truncated_databases"] == ["a"]
+    assert union[0]["results"] == [{"_database": "a", "n": 1}, {"_database": "b", "n": 2}]
+
+    aggregate = merge_fanout_results(targets, "aggregate", ["SELECT COUNT(*) AS n FROM t"])
+    assert aggregate[0]["status"] == "error"
+    assert aggregate[0]["truncated_databases"] == ["a"]
@@ -0,0 +1,83 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("azure.functions")
+pytest.importorskip("openai")
+pyodbc = pytest.importorskip("pyodbc")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from function_app import parameterize_sql  # noqa: E402
+
+
+# (requête, requête paramétrée attendue, paramètres attendus)
+PARAMETERIZED_CASES = [
+    ("SELECT * FROM t WHERE id = 42",
+     "SELECT * FROM t WHERE id = ?", [42]),
+    ("SELECT TOP 10 * FROM t WHERE x = 'a'",
+     "SELECT TOP 10 * FROM t WHERE x = ?", ["a"]),
+    ("SELECT TOP (5) nom FROM t WHERE y = 3",
+     "SELECT TOP (5) nom FROM t WHERE y = ?", [3]),
+    ("SELECT nom FROM t WHERE x = 'a' ORDER BY 1, 'b'",
+     "SELECT nom FROM t WHERE x = ? ORDER BY 1, 'b'", ["a"]),
+    ("SELECT nom FROM t WHERE x = 1 ORDER BY 2 OFFSET 10 ROWS",
+     "SELECT nom FROM t WHERE x = ? ORDER BY 2 OFFSET ? ROWS", [1, 10]),
+    ("SELECT nom FROM t WHERE nom LIKE 'a!%%' ESCAPE '!'",
+     "SELECT nom FROM t WHERE nom LIKE ? ESCAPE '!'", ["a!%%"]),
+    ("SELECT * FROM t WHERE nom = N'Zoé' AND code = 'l''été'",
+     "SELECT * FROM t WHERE nom = ? AND code = ?", ["Zoé", "l'été"]),
+    ("SELECT CONVERT(varchar(10), d, 103) FROM t WHERE id = 7",
+     "SELECT CONVERT(varchar(10), d, 103) FROM t WHERE id = ?", [7]),
+    ("SELECT CAST(x AS decimal(10, 2)) FROM t WHERE id = 7",
+     "SELECT CAST(x AS decimal(10, 2)) FROM t WHERE id = ?", [7]),
+    ("SELECT COUNT(*) AS 'Total' FROM t WHERE statut = 'actif'",
+     "SELECT COUNT(*) AS 'Total' FROM t WHERE statut = ?", ["actif"]),
+    ("SELECT * FROM t WHERE id IN (SELECT TOP 5 c FROM u ORDER BY c) AND z = 'q'",
+     "SELECT * FROM t WHERE id IN (SELECT TOP 5 c FROM u ORDER BY c) AND z = ?", ["q"]),
+    ("SELECT ROW_NUMBER() OVER (ORDER BY d) AS rn FROM t WHERE z = 'q'",
+     "SELECT ROW_NUMBER() OVER (ORDER BY d) AS rn FROM t WHERE z = ?", ["q"]),
+    ("SELECT nom FROM t WHERE x = 1 ORDER BY LEFT(nom, 3)",
+     "SELECT nom FROM t WHERE x = ? ORDER BY LEFT(nom, 3)", [1]),
+    ("SELECT * FROM t WHERE id IN (SELECT c FROM u GROUP BY c) AND z = 'q'",
+     "SELECT * FROM t WHERE id IN (SELECT c FROM u GROUP BY c) AND z = ?", ["q"]),
+    ("SELECT a FROM t GROUP BY a HAVING COUNT(*) > 3",
+     "SELECT a FROM t GROUP BY a HAVING COUNT(*) > ?", [3]),
+    ("SELECT [it's] FROM t WHERE v = 1.5 AND w = 2",
+     "SELECT [it's] FROM t WHERE v = 1.5 AND w = ?", [2]),
+    ("UPDATE t SET nom = 'x' WHERE id = 3 -- 'commentaire'",
+     "UPDATE t SET nom = ? WHERE id = ? -- 'commentaire'", ["x", 3]),
+]
+
+# Requêtes envoyées telles quelles
+UNCHANGED_CASES = [
+    "CREATE TABLE t (id int)",
+    "DECLARE @x int = 1; SELECT @x",
+    "SELECT * FROM t WHERE id = ?",
+    "SELECT * FROM t WHERE nom = 'non fermée",
+    "SELECT LEFT(nom, 3) FROM t GROUP BY LEFT(nom, 3)",
+    "SELECT nom FROM t ORDER BY 1",
+]
+
+
+@pytest.mark.parametrize("sql_query, template, params", PARAMETERIZED_CASES)
+def test_parameterize_sql(sql_query, template, params):
+    result = parameterize_sql(sql_query)
+    assert result is not None
+    assert result[0] == template
+    assert result[1] == params
+    assert len(result[2]) == len(params)
+
+
+@pytest.mark.parametrize("sql_query", UNCHANGED_CASES)
+def test_parameterize_sql_unchanged(sql_query):
+    assert parameterize_sql(sql_query) is None
+
+
+def test_parameterize_sql_input_sizes():
+    _, _, input_sizes = parameterize_sql("SELECT * FROM t WHERE a = N'x' AND b = 'y' AND c = 1")
+    assert input_sizes == [
+        (pyodbc.SQL_WVARCHAR, 4000, 0),
+        (pyodbc.SQL_VARCHAR, 8000, 0),
+        (pyodbc.SQL_INTEGER, 0, 0),
+    ]
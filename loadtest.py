@@ -0,0 +1,447 @@
+"""Générateur de charge pour les routes chat, set-db-config et test-db.
+
+Rejoue un corpus JSONL de questions (une ligne JSON par requête, comme requests.jsonl)
+soit contre la function app déployée (--url), soit directement contre les handlers
+en mémoire (--in-process) avec une base SQLite locale et un générateur SQL factice
+à la place d'Azure SQL et d'Azure OpenAI.
+
+Champs reconnus par ligne du corpus :
+  route    : "chat" (défaut), "set-db-config" ou "test-db"
+  message  : question envoyée à /chat (à défaut : "title", puis "body")
+  payload  : body JSON complet à envoyer tel quel (prioritaire sur message)
+  sql      : SQL renvoyé par le générateur factice pour ce message (mode --in-process)
+
+Exemples :
+  python loadtest.py --corpus requests.jsonl --in-process --concurrency 8 --rate 20
+  python loadtest.py --corpus questions.jsonl --url https://<app>.azurewebsites.net/api \\
+      --db-config db.json --concurrency 4 --requests 200 --output report.json
+"""
+import argparse
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_STANDIN_SQL = "SELECT * FROM [dbo].[utilisateurs]"
+STANDIN_TYPES = {"INTEGER": "int", "TEXT": "nvarchar", "REAL": "float"}
+
+# Durées par étape de la requête en cours (mode --in-process)
+stage_timings = threading.local()
+
+
+def load_corpus(path):
+    """Charge le corpus JSONL en liste de requêtes {route, payload, sql}"""
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                print(f"Ligne {line_number} ignorée: JSON invalide")
+                continue
+
+            route = item.get("route", "chat")
+            if "payload" in item:
+                payload = item["payload"]
+            elif route == "chat":
+                message = item.get("message") or item.get("title") or item.get("body") or ""
+                payload = {"message": message}
+            else:
+                payload = None
+            entries.append({"route": route, "payload": payload, "sql": item.get("sql")})
+    return entries
+
+
+def percentile(sorted_values, pct):
+    """Percentile au rang le plus proche sur une liste triée"""
+    if not sorted_values:
+        return None
+    rank = max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)
+    return round(sorted_values[rank], 2)
+
+
+def summarize(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 2),
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": round(values[-1], 2),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Cible HTTP
+# ---------------------------------------------------------------------------
+
+def make_http_sender(base_url, timeout):
+    base_url = base_url.rstrip("/")
+
+    def send(route, payload):
+        data = json.dumps(payload).encode("utf-8") if payload is not None else None
+        request = urllib.request.Request(
+            f"{base_url}/{route}",
+            data=data,
+            method="POST" if data is not None else "GET",
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                status, body = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, body = e.code, e.read()
+
+        # Le temps d'exécution SQL est la seule étape visible côté client
+        stages = {}
+        try:
+            parsed = json.loads(body)
+            if isinstance(parsed, dict) and "total_execution_time_ms" in parsed:
+                stages["sql_execution"] = parsed["total_execution_time_ms"]
+        except ValueError:
+            parsed = None
+        return status, parsed, stages
+
+    return send
+
+
+# ---------------------------------------------------------------------------
+# Cible en mémoire (handlers + base SQLite + générateur SQL factice)
+# ---------------------------------------------------------------------------
+
+def create_standin_database(directory, rows):
+    """Crée une base SQLite avec un schéma 'dbo' proche de table_columns.txt"""
+    main_path = os.path.join(directory, "main.sqlite")
+    dbo_path = os.path.join(directory, "dbo.sqlite")
+    conn = sqlite3.connect(main_path)
+    conn.execute("ATTACH DATABASE ? AS dbo", (dbo_path,))
+    conn.execute("CREATE TABLE dbo.utilisateurs (id INTEGER PRIMARY KEY, nom TEXT, pays TEXT, date_inscription TEXT)")
+    conn.execute("CREATE TABLE dbo.commandes (id INTEGER PRIMARY KEY, utilisateur_id INTEGER, montant REAL, date_commande TEXT)")
+    pays = ["Tunisie", "France", "USA", "Maroc", "Canada"]
+    conn.executemany(
+        "INSERT INTO dbo.utilisateurs VALUES (?, ?, ?, ?)",
+        [(i, f"user{i}", pays[i % len(pays)], f"2023-{i % 12 + 1:02d}-10") for i in range(1, rows + 1)],
+    )
+    conn.executemany(
+        "INSERT INTO dbo.commandes VALUES (?, ?, ?, ?)",
+        [(100 + i, i % rows + 1, round(random.uniform(5, 500), 2), f"2023-{i % 12 + 1:02d}-01") for i in range(rows * 3)],
+    )
+    conn.commit()
+    conn.close()
+    return main_path, dbo_path
+
+
+class StandInCursor:
+    """Curseur SQLite exposant les méthodes pyodbc utilisées par la function app"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def setinputsizes(self, sizes):
+        pass
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class StandInConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return StandInCursor(self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def timed(name, fn):
+    """Enveloppe une étape du handler pour mesurer sa durée dans le thread courant"""
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            stages = getattr(stage_timings, "current", None)
+            if stages is not None:
+                stages[name] = stages.get(name, 0) + elapsed
+    return wrapper
+
+
+def make_inprocess_sender(corpus, args):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "assistant-sql"))
+    try:
+        import azure.functions as func
+        import function_app
+    except ImportError as e:
+        print(f"Erreur: dépendances de la function app manquantes ({e}).")
+        print("Installez-les avec: pip install -r assistant-sql/requirements.txt")
+        sys.exit(1)
+
+    main_path, dbo_path = create_standin_database(tempfile.mkdtemp(prefix="loadtest-"), args.rows)
+
+    def standin_connect(connection_string, timeout=None, **kwargs):
+        conn = sqlite3.connect(main_path, timeout=30, check_same_thread=False)
+        conn.execute("ATTACH DATABASE ? AS dbo", (dbo_path,))
+        return StandInConnection(conn)
+
+    sql_by_message = {
+        entry["payload"]["message"]: entry["sql"]
+        for entry in corpus
+        if entry["sql"] and isinstance(entry["payload"], dict) and "message" in entry["payload"]
+    }
+
+    def standin_generate_sql(user_message, schema):
+        # Latence simulée du modèle (moyenne --llm-latency-ms, ±50 %)
+        if args.llm_latency_ms > 0:
+            time.sleep(args.llm_latency_ms * random.uniform(0.5, 1.5) / 1000)
+        return sql_by_message.get(user_message, DEFAULT_STANDIN_SQL)
+
+    def standin_schema_metadata(db_config, deadline=None):
+        # Même structure que get_db_schema_metadata, lue depuis la base SQLite
+        if args.schema_latency_ms > 0:
+            time.sleep(args.schema_latency_ms / 1000)
+        conn = sqlite3.connect(main_path)
+        conn.execute("ATTACH DATABASE ? AS dbo", (dbo_path,))
+        metadata = []
+        tables = conn.execute("SELECT name FROM dbo.sqlite_master WHERE type = 'table' ORDER BY name").fetchall()
+        for (table,) in tables:
+            columns = [
+                {
+                    "name": name,
+                    "type": STANDIN_TYPES.get(sqlite_type.upper(), sqlite_type.lower()),
+                    "nullable": not notnull and not pk,
+                    # SQLite ne borne pas TEXT : longueur fixe comme un nvarchar(50)
+                    "max_length": 50 if sqlite_type.upper() == "TEXT" else None,
+                    "primary_key": bool(pk),
+                    "foreign_key": None,
+                }
+                for _, name, sqlite_type, notnull, _, pk in conn.execute(f"PRAGMA dbo.table_info({table})")
+            ]
+            cursor = conn.execute(f"SELECT * FROM dbo.{table} LIMIT 20")
+            rows = cursor.fetchall()
+            names = [description[0] for description in cursor.description]
+            metadata.append({
+                "schema": "dbo",
+                "table": table,
+                "columns": columns,
+                "example_row": dict(zip(names, rows[0])) if rows else None,
+                "sample_values": {
+                    column["name"]: [row[names.index(column["name"])] for row in rows]
+                    for column in columns if function_app.is_sample_candidate(column)
+                },
+                "sample_error": None,
+            })
+        conn.close()
+        return metadata
+
+    function_app.pyodbc.connect = standin_connect
+    function_app.get_db_schema_metadata = standin_schema_metadata
+    function_app.generate_sql_from_question = standin_generate_sql
+    function_app.pyodbc.connect = timed("connect", function_app.pyodbc.connect)
+    for stage, attribute in [
+        ("schema", "get_db_schema"),
+        ("llm", "generate_sql_from_question"),
+        ("sql_execution", "execute_multiple_sql_queries"),
+    ]:
+        setattr(function_app, attribute, timed(stage, getattr(function_app, attribute)))
+
+    handlers = {
+        "chat": function_app.main,
+        "set-db-config": function_app.set_database_config,
+        "test-db": function_app.test_db,
+    }
+
+    def send(route, payload):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        request = func.HttpRequest(
+            method="POST" if payload is not None else "GET",
+            url=f"/api/{route}",
+            headers={"Content-Type": "application/json"},
+            params={},
+            body=body,
+        )
+        stage_timings.current = {}
+        response = handlers[route](request)
+        stages, stage_timings.current = stage_timings.current, None
+        try:
+            parsed = json.loads(response.get_body())
+        except ValueError:
+            parsed = None
+        return response.status_code, parsed, stages
+
+    return send
+
+
+# ---------------------------------------------------------------------------
+# Boucle de charge
+# ---------------------------------------------------------------------------
+
+def run_load(send, corpus, args):
+    records = []
+    records_lock = threading.Lock()
+    total = args.requests or len(corpus)
+
+    def execute(entry, scheduled_at):
+        started_at = time.perf_counter()
+        try:
+            status, parsed, stages = send(entry["route"], entry["payload"])
+            error = None
+        except Exception as e:
+            status, parsed, stages, error = None, None, {}, str(e)
+        finished_at = time.perf_counter()
+
+        app_status = parsed.get("status") if isinstance(parsed, dict) else None
+        with records_lock:
+            records.append({
+                "route": entry["route"],
+                "status_code": status,
+                "app_status": app_status,
+                "error": error or (status is None or status >= 400),
+                # Latence mesurée depuis l'arrivée prévue (boucle ouverte) ou l'envoi (boucle fermée)
+                "latency_ms": (finished_at - scheduled_at) * 1000,
+                "service_ms": (finished_at - started_at) * 1000,
+                "stages": stages,
+            })
+
+    started = time.perf_counter()
+    if args.rate > 0:
+        # Arrivées en boucle ouverte (processus de Poisson au débit --rate) :
+        # la latence inclut l'attente en file si le service sature
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            next_arrival = started
+            for i in range(total):
+                delay = next_arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                executor.submit(execute, corpus[i % len(corpus)], next_arrival)
+                next_arrival += random.expovariate(args.rate)
+    else:
+        # Boucle fermée : chaque worker envoie la requête suivante dès que la
+        # précédente est terminée, la latence est mesurée depuis l'envoi
+        next_index = itertools.count()
+
+        def worker():
+            while True:
+                i = next(next_index)
+                if i >= total:
+                    return
+                execute(corpus[i % len(corpus)], time.perf_counter())
+
+        workers = [threading.Thread(target=worker) for _ in range(min(args.concurrency, total))]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+    duration = time.perf_counter() - started
+
+    return build_report(records, duration, args)
+
+
+def build_report(records, duration, args):
+    def route_summary(items):
+        errors = sum(1 for r in items if r["error"])
+        app_errors = sum(1 for r in items if r["app_status"] in ("error", "partial"))
+        return {
+            "requests": len(items),
+            "errors": errors,
+            "error_rate": round(errors / len(items), 4) if items else 0,
+            "app_errors": app_errors,
+            "app_error_rate": round(app_errors / len(items), 4) if items else 0,
+            "latency_ms": summarize([r["latency_ms"] for r in items]),
+            "service_ms": summarize([r["service_ms"] for r in items]),
+        }
+
+    stage_values = {}
+    status_codes = {}
+    for record in records:
+        for stage, value in record["stages"].items():
+            stage_values.setdefault(stage, []).append(value)
+        key = str(record["status_code"])
+        status_codes[key] = status_codes.get(key, 0) + 1
+
+    return {
+        "mode": "in-process" if args.in_process else "http",
+        "target": None if args.in_process else args.url,
+        "concurrency": args.concurrency,
+        "target_rate_rps": args.rate or None,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(records) / duration, 2) if duration else 0,
+        "overall": route_summary(records),
+        "routes": {
+            route: route_summary([r for r in records if r["route"] == route])
+            for route in sorted({r["route"] for r in records})
+        },
+        "stages_ms": {stage: summarize(values) for stage, values in sorted(stage_values.items())},
+        "status_codes": status_codes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de l'assistant SQL")
+    parser.add_argument("--corpus", required=True, help="Fichier JSONL des requêtes à rejouer")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="URL de base de la function app (ex: https://<app>/api)")
+    target.add_argument("--in-process", action="store_true", help="Appeler les handlers en mémoire avec SQLite et un générateur SQL factice")
+    parser.add_argument("--concurrency", type=int, default=4, help="Nombre de requêtes simultanées (défaut: 4)")
+    parser.add_argument("--rate", type=float, default=0, help="Débit d'arrivée en requêtes/s (0 = boucle fermée)")
+    parser.add_argument("--requests", type=int, default=0, help="Nombre total de requêtes (défaut: taille du corpus)")
+    parser.add_argument("--db-config", help="Fichier JSON {'server','database','username','password'} envoyé à set-db-config avant le test")
+    parser.add_argument("--timeout", type=float, default=120, help="Timeout HTTP par requête en secondes")
+    parser.add_argument("--llm-latency-ms", type=float, default=800, help="Latence moyenne simulée du modèle (--in-process)")
+    parser.add_argument("--schema-latency-ms", type=float, default=0, help="Latence simulée de lecture du schéma (--in-process)")
+    parser.add_argument("--rows", type=int, default=1000, help="Nombre de lignes de la base SQLite locale (--in-process)")
+    parser.add_argument("--output", help="Fichier du rapport JSON (défaut: sortie standard)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print("Erreur: corpus vide")
+        sys.exit(1)
+
+    if args.in_process:
+        send = make_inprocess_sender(corpus, args)
+        db_config = {"server": "local", "database": "standin", "username": "loadtest", "password": "loadtest"}
+    else:
+        send = make_http_sender(args.url, args.timeout)
+        db_config = None
+
+    if args.db_config:
+        with open(args.db_config, encoding="utf-8") as f:
+            db_config = json.load(f)
+    if db_config:
+        status, parsed, _ = send("set-db-config", db_config)
+        if status != 200:
+            print(f"Erreur: set-db-config a échoué ({status}): {parsed}")
+            sys.exit(1)
+
+    report = run_load(send, corpus, args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+        print(f"Rapport écrit dans {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()